@@ -4,6 +4,18 @@ from mock import Mock
 import pytest
 
 from workspace.controller import Commander
+from workspace.scm import WorkspaceIndex
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmpdir_factory):
+    """ Keep caches (such as the workspace index) out of the user's cache dir """
+    cache_dir = str(tmpdir_factory.mktemp('cache'))
+    monkeypatch.setattr('workspace.config.CACHE_DIR', cache_dir)
+    monkeypatch.setattr('workspace.scm.CACHE_DIR', cache_dir)
+    monkeypatch.setattr('workspace.commands.helpers.CACHE_DIR', cache_dir)
+    monkeypatch.setattr('workspace.scm._workspace_index', WorkspaceIndex())
+    return cache_dir
 
 
 @pytest.fixture()
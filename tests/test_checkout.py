@@ -1,6 +1,10 @@
 import os
 
+import pytest
 from test_stubs import temp_dir
+from utils.process import run
+from workspace.commands.checkout import Checkout
+from workspace.config import config
 
 
 def test_checkout_with_http_git(wst):
@@ -20,3 +24,34 @@ def test_checkout_with_multiple_repos(wst):
         wst('checkout https://github.com/confluentinc/localconfig.git https://github.com/confluentinc/remoteconfig.git')
         assert os.path.exists('localconfig/README.rst')
         assert os.path.exists('remoteconfig/README.rst')
+
+
+def test_checkout_with_multiple_local_repos(wst, capsys):
+    with temp_dir() as remote_dir:
+        for name in ['first', 'second']:
+            run('git init ' + name)
+            run('git commit --allow-empty -m Init', cwd=name)
+
+        with temp_dir():
+            wst('checkout file://{0}/first file://{0}/second'.format(remote_dir))
+            assert os.path.exists('first/.git')
+            assert os.path.exists('second/.git')
+
+            with pytest.raises(SystemExit):
+                wst('checkout file://{0}/first file://{0}/missing'.format(remote_dir))
+
+            out, _ = capsys.readouterr()
+            assert 'first: Checked out\n' in out
+            assert 'first: Updated\n' in out
+            assert 'Failed to checkout / update 1 product(s):\n    missing: ' in out
+
+
+def test_clone_strategy(monkeypatch):
+    monkeypatch.setattr(config.checkout, 'clone_strategies', 'big=shallow monorepo=blobless')
+    monkeypatch.setattr('workspace.commands.helpers.product_groups',
+                        lambda: {'big': ['git@github.com:maxzheng/huge.git', 'large']})
+
+    assert Checkout.clone_strategy('git@github.com:maxzheng/huge.git') == 'shallow'
+    assert Checkout.clone_strategy('large') == 'shallow'
+    assert Checkout.clone_strategy('maxzheng/monorepo') == 'blobless'
+    assert Checkout.clone_strategy('small') is None
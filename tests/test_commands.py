@@ -1,11 +1,13 @@
 import logging
 import os
+import time
 
 import pytest
 from bumper.utils import PyPI
 from mock import Mock
 from test_stubs import temp_dir, temp_git_repo, temp_remote_git_repo
 from utils.process import run
+from workspace.commands.clean import delete_trash
 from workspace.config import config
 from workspace.scm import stat_repo, all_branches
 
@@ -86,6 +88,57 @@ def test_cleanrun(wst):
         assert_list_equals_without_Order(os.listdir(), ['.git', 'hello.py'])
 
 
+def test_clean_with_trash(wst, capsys, caplog, monkeypatch):
+    monkeypatch.setattr(config.clean, 'remove_products_older_than_days', 30)
+
+    with temp_dir():
+        for repo in ['repo', 'old_repo']:
+            run('git init ' + repo)
+            run('git commit --allow-empty -m Init', cwd=repo)
+        run('touch -t 200001181205.09 old_repo')
+        capsys.readouterr()
+
+        wst('clean --dry-run')
+        out, _ = capsys.readouterr()
+        assert '  - Would remove "old_repo" (' in out
+        assert os.path.exists('old_repo')
+
+        wst('clean')
+        out, _ = capsys.readouterr()
+        assert 'Removed old_repo\n' in out
+        assert sorted(os.listdir()) in (['.wst-trash', 'repo'], ['repo'])
+
+        for _ in range(100):  # Wait for background delete
+            if not os.path.exists('.wst-trash'):
+                break
+            time.sleep(0.1)
+        assert os.listdir() == ['repo']
+
+        # Errors of the background delete are shown and it is retried on next clean, even without products to remove
+        os.makedirs('.wst-trash/1/old_repo')
+        os.makedirs('.wst-trash/2/other_repo')  # Still being deleted by another run
+
+        def rmtree(path, onerror):
+            onerror(os.rmdir, path, (OSError, OSError('Permission denied'), None))
+        with monkeypatch.context() as m:
+            m.setattr('shutil.rmtree', rmtree)
+            delete_trash(os.path.abspath('.wst-trash/1'))
+        assert sorted(os.listdir('.wst-trash')) == ['1', '1.log', '2']
+
+        monkeypatch.setattr(config.clean, 'remove_products_older_than_days', 0)
+        with caplog.at_level(logging.WARNING):
+            wst('clean')
+        assert 'did not complete: 1 entries left in ' in caplog.text
+        assert 'old_repo: Permission denied' in caplog.text
+        assert 'Deleting 1 entries in the background' in capsys.readouterr()[0]
+
+        for _ in range(100):  # Wait for background delete
+            if os.listdir('.wst-trash') == ['2']:
+                break
+            time.sleep(0.1)
+        assert os.listdir('.wst-trash') == ['2']
+
+
 def test_commit(wst):
     with temp_dir():
         with pytest.raises(SystemExit):
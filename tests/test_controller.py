@@ -0,0 +1,28 @@
+import os
+import sys
+
+from test_stubs import temp_git_repo
+from utils.process import run
+from workspace.commands.status import Status
+from workspace.controller import COMMANDS, Commander
+import workspace
+
+
+def test_command():
+    assert Commander.command('status') is Status
+    assert Commander.command('st') is Status
+    assert Commander.command('unknown') is None
+    assert sorted(Commander.commands()) == sorted(COMMANDS)
+
+
+def test_only_selected_command_is_imported():
+    script = ('import sys; sys.argv = ["wst", "st"]\n'
+              'from workspace.controller import Commander; Commander().run()\n'
+              'print(sorted(m for m in sys.modules if m.startswith("workspace.commands.") or m in ("requests", "git")))')
+
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(workspace.__file__)))
+
+    with temp_git_repo():
+        output = run([sys.executable, '-c', script], return_output=True, env=env)
+
+    assert output.strip().split('\n')[-1] == "['workspace.commands.helpers', 'workspace.commands.status']"
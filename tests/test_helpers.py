@@ -1,4 +1,8 @@
-from workspace.commands.helpers import expand_product_groups
+import os
+
+from test_stubs import temp_dir
+from utils.process import run
+from workspace.commands.helpers import expand_product_groups, DependencyGraph, ToxIni
 
 
 def test_expand_product_groups(monkeypatch):
@@ -10,3 +14,51 @@ def test_expand_product_groups(monkeypatch):
     assert expand_product_groups(['ws', 'name2']) == sorted(['workspace-tools', 'clicast', 'localconfig', 'remoteconfig', 'name2'])
     assert expand_product_groups(['ws', '-localconfig']) == sorted(['workspace-tools', 'clicast', 'remoteconfig'])
     assert expand_product_groups(['ws', '-config']) == sorted(['workspace-tools', 'clicast'])
+
+
+def test_dependency_graph(monkeypatch):
+    with temp_dir() as workspace:
+        for name, requirements in [('base', ''), ('middle', 'Base>=1.0'), ('top', 'middle\nrequests'),
+                                   ('other', 'base')]:
+            run('git init ' + name)
+            (workspace / name / 'requirements.txt').write_text(requirements)
+
+        graph = DependencyGraph.for_workspace(str(workspace))
+        assert graph.dependencies == {'base': set(), 'middle': {'base'}, 'top': {'middle'}, 'other': {'base'}}
+        assert graph.dependents('base') == {'middle', 'top', 'other'}
+        assert graph.dependents('base', transitive=False) == {'middle', 'other'}
+        assert graph.waves(['top', 'middle', 'other', 'base']) == [['base'], ['middle', 'other'], ['top']]
+        assert DependencyGraph.for_workspace(str(workspace)) is graph
+
+        # Loaded from the cache file in a new run
+        with monkeypatch.context() as m:
+            m.setattr(DependencyGraph, '_graphs', {})
+            m.setattr('workspace.commands.helpers.requirement_names', None)
+            loaded_graph = DependencyGraph.for_workspace(str(workspace))
+            assert loaded_graph is not graph and loaded_graph.dependencies == graph.dependencies
+
+        (workspace / 'top' / 'requirements.txt').write_text('base')
+        graph = DependencyGraph.for_workspace(str(workspace))
+        assert graph.waves(graph.dependents('base')) == [['middle', 'other', 'top']]
+
+
+def test_tox_ini():
+    with temp_dir() as tmpdir:
+        run('git init')
+        (tmpdir / 'tox.ini').write_text('[tox]\nenvlist = py3, style\n\n'
+                                        '[testenv]\nbasepython = python3\ncommands = pytest {env:PYTESTARGS:}\n\n'
+                                        '[testenv:style]\ncommands =\n  flake8 \\\n    {toxinidir}/src\n\n'
+                                        '[testenv:cover]\nenvdir = {homedir}/venvs/{envname}\n')
+
+        tox = ToxIni.for_path(str(tmpdir))
+        assert ToxIni.for_path(str(tmpdir)) is tox
+        assert sorted(tox.envs) == ['cover', 'py3', 'style']
+        assert tox.env('py3') == {'envdir': str(tmpdir / '.tox/py3'), 'bindir': str(tmpdir / '.tox/py3/bin'),
+                                  'commands': ['pytest {env:PYTESTARGS:}'], 'basepython': 'python3'}
+        assert tox.commands('style') == ['flake8 {}/src'.format(tmpdir)]
+        assert tox.envdir('cover') == os.path.expanduser('~/venvs/cover')
+        assert tox.bindir('other', 'pytest') == str(tmpdir / '.tox/other/bin/pytest')
+
+        (tmpdir / 'tox.ini').write_text('[tox]\nenvlist = py3\n')
+        assert ToxIni.for_path(str(tmpdir)) is not tox
+        assert ToxIni.for_path(str(tmpdir)).envlist == ['py3']
@@ -0,0 +1,308 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from test_stubs import temp_dir, temp_git_repo
+from utils.process import run
+from workspace.config import config
+from workspace.scm import (all_branches, checkout_product, clean_state, commit_logs, create_branch, current_branch,
+                           diff_stats, invalidate_repo_state, is_shallow, mirror_path, product_path,
+                           remote_tracking_branch, repo_state, repo_status, update_repo, RepoSearch, SCMError,
+                           SSHMultiplexer, WorkspaceIndex)
+
+
+def test_repo_state():
+    with temp_git_repo():
+        assert repo_state().branches == []
+        assert repo_state().head is None
+        assert current_branch() is None
+
+        run('git commit --allow-empty -m Dummy')
+        assert current_branch() is None  # Cached until invalidated
+
+        invalidate_repo_state()
+        assert current_branch() == 'master'
+        assert repo_state() is repo_state()
+        assert not repo_state().dirty
+        assert remote_tracking_branch() is None
+
+        create_branch('feature')
+        assert all_branches() == ['feature', 'master']
+
+        run('git checkout HEAD^0')
+        invalidate_repo_state()
+        head = repo_state().head
+        assert all_branches(verbose=True) == [head + '*', 'feature', 'master']
+
+        run('touch new_file')
+        invalidate_repo_state()
+        assert repo_state().dirty
+
+
+def test_repo_state_remotes():
+    with temp_git_repo() as remote_dir:
+        run('git commit --allow-empty -m Dummy')
+
+        with temp_git_repo():
+            run('git remote add origin ' + str(remote_dir))
+            run('git fetch origin')
+            run('git checkout -b master origin/master')
+            invalidate_repo_state()
+
+            assert repo_state().remotes == {'origin': str(remote_dir)}
+            assert remote_tracking_branch() == 'origin/master'
+            assert all_branches(remotes=True) == ['master', 'remotes/origin/master']
+
+
+def test_workspace_index(tmpdir):
+    index = WorkspaceIndex(str(tmpdir / 'workspaces.json'))
+
+    with temp_dir() as workspace:
+        run('git init foo')
+        run('git init bar_trunk')
+        run('git remote add origin git@github.com:maxzheng/bar.git', cwd='bar_trunk')
+        run('mkdir not_a_repo')
+
+        assert index.repos(workspace) == [str(workspace / 'bar_trunk'), str(workspace / 'foo')]
+        assert index.products(workspace) == {'bar': str(workspace / 'bar_trunk'), 'foo': str(workspace / 'foo')}
+        assert index.entries(workspace)[0]['remotes'] == {'origin': 'git@github.com:maxzheng/bar.git'}
+
+        # Loaded from the index file by a new instance
+        assert WorkspaceIndex(index.index_file).repos(workspace) == index.repos(workspace)
+
+        run('git remote add upstream git@github.com:confluentinc/bar.git', cwd='bar_trunk')
+        assert sorted(index.entries(workspace)[0]['remotes']) == ['origin', 'upstream']
+
+        run('rm -rf foo')
+        assert index.repos(workspace) == [str(workspace / 'bar_trunk')]
+
+        # Existing dir that becomes a repo
+        run('git init', cwd='not_a_repo')
+        assert index.repos(workspace) == [str(workspace / 'bar_trunk'), str(workspace / 'not_a_repo')]
+
+        # Checkout with the product name as its dir name is used for the product
+        run('git init bar')
+        assert index.products(workspace)['bar'] == str(workspace / 'bar')
+        run('git init foo_trunk')
+        assert index.products(workspace)['foo'] == str(workspace / 'foo_trunk')
+        run('git init foo')
+        assert index.products(workspace)['foo'] == str(workspace / 'foo')
+        assert len(index.repos(workspace)) == 5
+        assert product_path('foo', str(workspace)) == str(workspace / 'foo')
+        assert product_path('baz', str(workspace)) == str(workspace / 'baz')
+
+
+def test_update_repo_from_multiple_remotes(capsys):
+    with temp_git_repo() as origin:
+        run('git commit --allow-empty -m Dummy')
+
+        with temp_git_repo() as upstream:
+            run('git pull ' + str(origin) + ' master')
+            run('git commit --allow-empty -m Upstream')
+            run('git tag v1.0')
+
+            with temp_git_repo():
+                run('git remote add origin ' + str(origin))
+                run('git remote add upstream ' + str(upstream))
+                run('git fetch origin')
+                run('git checkout -b master origin/master')
+                invalidate_repo_state()
+
+                update_repo()
+                assert repo_state().head == run('git rev-parse --short v1.0', return_output=True).strip()
+
+                run('git commit --allow-empty -m Local')
+                run('git commit --allow-empty -m Diverged', cwd=str(upstream))
+                with pytest.raises(SCMError):
+                    update_repo()
+
+                out, _ = capsys.readouterr()
+                assert out.endswith('... from upstream\n    ...   Not possible to fast-forward, aborting\n')
+
+
+def test_ssh_multiplexer(monkeypatch):
+    monkeypatch.delenv('GIT_SSH', raising=False)
+    monkeypatch.delenv('GIT_SSH_COMMAND', raising=False)
+
+    with SSHMultiplexer(control_persist=5) as multiplexer:
+        assert 'ControlPath={}/%r@%h:%p'.format(multiplexer.control_dir) in os.environ['GIT_SSH_COMMAND']
+        assert 'ControlPersist=5' in os.environ['GIT_SSH_COMMAND']
+        assert multiplexer.hosts == []
+        control_dir = multiplexer.control_dir
+
+        # Nested use keeps the outer connections
+        with SSHMultiplexer() as nested:
+            assert nested.control_dir is None
+
+    assert 'GIT_SSH_COMMAND' not in os.environ
+    assert not os.path.exists(control_dir)
+
+    monkeypatch.setenv('GIT_SSH_COMMAND', 'my-ssh')
+    with SSHMultiplexer():
+        assert os.environ['GIT_SSH_COMMAND'] == 'my-ssh'
+
+
+def test_checkout_product_with_clone_strategy(monkeypatch):
+    monkeypatch.setattr(config.checkout, 'clone_depth', 2)
+
+    with temp_git_repo() as remote_dir:
+        for i in range(5):
+            run('git commit --allow-empty -m Commit{}'.format(i))
+
+        with temp_dir() as workspace:
+            shallow_repo = str(workspace / 'shallow')
+            checkout_product('file://' + str(remote_dir), shallow_repo, quiet=True, clone_strategy='shallow')
+            assert is_shallow(shallow_repo)
+
+            def logged_commits(**kwargs):
+                return commit_logs(repo=shallow_repo, **kwargs).count('\ncommit ') + 1
+
+            assert logged_commits(limit=3) == 3
+            assert is_shallow(shallow_repo)
+
+            assert logged_commits() == 5
+            assert not is_shallow(shallow_repo)
+
+            with pytest.raises(SCMError):
+                checkout_product('file://' + str(remote_dir), str(workspace / 'other'), clone_strategy='partial')
+
+
+def test_checkout_product_with_mirror_cache(monkeypatch, tmpdir):
+    monkeypatch.setattr(config.checkout, 'mirror_cache', True)
+    monkeypatch.setattr('workspace.scm.CACHE_DIR', str(tmpdir))
+
+    assert mirror_path('git@github.com:maxzheng/clicast.git') == str(tmpdir / 'mirrors/github.com/maxzheng/clicast.git')
+    assert mirror_path('https://github.com/maxzheng/clicast') == str(tmpdir / 'mirrors/github.com/maxzheng/clicast.git')
+
+    with temp_git_repo() as remote_dir:
+        run('git commit --allow-empty -m Init')
+        product_url = 'file://' + str(remote_dir)
+        mirror = mirror_path(product_url)
+
+        with temp_dir() as workspace:
+            checkout_product(product_url, str(workspace / 'first'))
+            assert os.path.exists(mirror)
+
+            run('git commit --allow-empty -m Update', cwd=str(remote_dir))
+            checkout_product(product_url, str(workspace / 'second'))
+
+            mirror_head = run('git rev-parse master', cwd=mirror, return_output=True)
+            assert mirror_head == run('git rev-parse HEAD', cwd=str(workspace / 'second'), return_output=True)
+
+            # Dissociated from the mirror
+            assert not os.path.exists(str(workspace / 'second/.git/objects/info/alternates'))
+
+
+def test_repo_search(monkeypatch, tmpdir):
+    searches = []
+    waits = []
+
+    class SearchHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            name = parse_qs(urlparse(self.path).query)['q'][0]
+            searches.append(name)
+
+            if name == 'limited' and searches.count(name) == 1:
+                self.send_response(403)
+                self.send_header('X-RateLimit-Remaining', '0')
+                self.send_header('X-RateLimit-Reset', str(int(time.time()) + 5))
+                self.end_headers()
+                return
+
+            items = [] if name == 'missing' else [{'ssh_url': 'git@example.com:org/{}.git'.format(name)}]
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(json.dumps({'items': items}).encode('utf-8'))
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), SearchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(config.checkout, 'search_api_url', 'http://127.0.0.1:{}/search'.format(server.server_port))
+    monkeypatch.setattr('workspace.scm.time.sleep', waits.append)
+
+    try:
+        search = RepoSearch(str(tmpdir / 'repo_search.json'), cache_days=1)
+        urls = search.resolve_all(['first', 'limited', 'missing'], raises=False)
+
+        assert urls['first'] == 'git@example.com:org/first.git'
+        assert urls['limited'] == 'git@example.com:org/limited.git'
+        assert 'No repo matching "missing" found' in str(urls['missing'])
+        assert sorted(searches) == ['first', 'limited', 'limited', 'missing']
+        assert len(waits) == 1 and 1 <= waits[0] <= 5
+
+        with pytest.raises(SCMError):
+            search.resolve('missing')
+
+        # Cached on disk, so no more searches
+        del searches[:]
+        assert RepoSearch(search.cache_file, cache_days=1).resolve('first') == 'git@example.com:org/first.git'
+        assert searches == []
+
+        # Expired
+        assert RepoSearch(search.cache_file, cache_days=0).resolve('first') == 'git@example.com:org/first.git'
+        assert searches == ['first']
+
+    finally:
+        server.shutdown()
+
+
+def test_repo_status_and_diff_stats():
+    with temp_git_repo():
+        assert repo_status() == {'branch': 'master', 'commit': None, 'upstream': None, 'ahead': 0, 'behind': 0,
+                                 'changes': [], 'clean': True}
+
+        run('touch old_name modified')
+        run('git add old_name modified')
+        run('git commit -m Add')
+        run('git mv old_name new_name')
+        run(['sh', '-c', 'echo change > modified && touch "with space"'])
+
+        status = repo_status()
+        assert status['commit'] == run('git rev-parse HEAD', return_output=True).strip()
+        assert status['changes'] == [{'path': 'modified', 'status': ' M'},
+                                     {'path': 'new_name', 'status': 'R ', 'orig_path': 'old_name'},
+                                     {'path': 'with space', 'status': '??'}]
+        assert not status['clean']
+
+        assert diff_stats() == [{'path': 'modified', 'added': 1, 'deleted': 0}]
+        assert diff_stats(branch='HEAD') == [{'path': 'modified', 'added': 1, 'deleted': 0},
+                                             {'path': 'new_name', 'orig_path': 'old_name', 'added': 0, 'deleted': 0}]
+
+
+def test_clean_state():
+    with temp_git_repo() as remote_dir:
+        run('git commit --allow-empty -m Init')
+
+        with temp_git_repo():
+            run('git remote add origin ' + str(remote_dir))
+            run('git fetch origin')
+            run('git checkout -b master origin/master')
+            assert clean_state() == {'clean': True, 'changes': 0, 'ahead': 0, 'behind': 0, 'branches': ['master']}
+
+            # Nothing would be lost when behind
+            run('git commit --allow-empty -m Update', cwd=str(remote_dir))
+            run('git fetch origin')
+            assert clean_state() == {'clean': True, 'changes': 0, 'ahead': 0, 'behind': 1, 'branches': ['master']}
+            run('git merge --ff-only origin/master')
+
+            run('git commit --allow-empty -m Unpushed')
+            run('git branch feature')
+            run('touch untracked')
+            invalidate_repo_state()
+            assert clean_state() == {'clean': False, 'changes': 1, 'ahead': 1, 'behind': 0,
+                                     'branches': ['feature', 'master']}
+
+        # Broken repo
+        with temp_dir():
+            run('git init -q')
+            run('rm .git/HEAD')
+            state = clean_state()
+            assert not state['clean'] and state['error']
+            assert not repo_status()['clean']
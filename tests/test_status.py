@@ -1,7 +1,8 @@
+import json
 import re
 
 from utils.process import run
-from test_stubs import temp_git_repo
+from test_stubs import temp_dir, temp_git_repo
 
 
 def test_status(wst, capsys):
@@ -24,3 +25,43 @@ def test_status(wst, capsys):
         wst('status')
         out, _ = capsys.readouterr()
         assert re.fullmatch('# Branches: \w+\* feature master\n', out)
+
+
+def test_status_multiple_repos(wst, capfd, monkeypatch):
+    monkeypatch.setenv('PAGER', 'cat')
+
+    with temp_dir():
+        names = ['repo{}'.format(i) for i in range(5)]
+        for name in names:
+            run('git init ' + name)
+            run('git commit --allow-empty -m Dummy', cwd=name)
+            run('git checkout -b feature@master', cwd=name)
+            run('touch file', cwd=name)
+        capfd.readouterr()
+
+        wst('status')
+        out, _ = capfd.readouterr()
+        assert [l for l in out.split('\n') if l.startswith('[')] == ['[ {} ]'.format(n) for n in names]
+        assert out.count('On branch feature@master') == 5
+
+
+def test_status_json(wst, capsys):
+    with temp_dir() as workspace:
+        for name in ['clean', 'dirty']:
+            run('git init ' + name)
+            run('git commit --allow-empty -m Dummy', cwd=name)
+        run('touch file', cwd='dirty')
+        capsys.readouterr()
+
+        wst('status --format ndjson')
+        out, _ = capsys.readouterr()
+        records = [json.loads(line) for line in out.strip().split('\n')]
+
+        assert [(r['product'], r['path'], r['clean'], r['branches']) for r in records] == [
+            ('clean', str(workspace / 'clean'), True, ['master']),
+            ('dirty', str(workspace / 'dirty'), False, ['master'])]
+        assert records[1]['changes'] == [{'path': 'file', 'status': '??'}]
+
+        wst('status --format json')
+        out, _ = capsys.readouterr()
+        assert json.loads(out) == records
@@ -0,0 +1,301 @@
+import json
+import os
+import sys
+import time
+from xml.etree import ElementTree
+
+import pytest
+from test_stubs import temp_dir, temp_git_repo
+from utils.process import run
+from workspace.commands.helpers import ToxIni
+from workspace.commands.test import Test, TestOutput
+from workspace.config import config
+
+
+def test_requirements_updated():
+    with temp_dir() as tmpdir:
+        with open('tox.ini', 'w') as fp:
+            fp.write('[tox]\nenvlist = py3\n')
+        with open('requirements.txt', 'w') as fp:
+            fp.write('requests\n')
+        os.makedirs('.tox/py3')
+
+        tox = ToxIni(str(tmpdir))
+        test = Test(repo=str(tmpdir))
+
+        # No manifest yet, so mtime is used once
+        assert not test.requirements_updated(tox, 'py3')
+        assert os.path.exists('.tox/py3/.wst-dependencies.json')
+
+        time.sleep(0.01)
+        os.utime('requirements.txt', None)
+        assert not test.requirements_updated(tox, 'py3')
+
+        with open('requirements.txt', 'w') as fp:
+            fp.write('requests\nclick\n')
+        assert test.requirements_updated(tox, 'py3')
+
+        with open('requirements.txt', 'w') as fp:
+            fp.write('requests\n')
+        assert not test.requirements_updated(tox, 'py3')
+
+        with open('setup.py', 'w') as fp:
+            fp.write('setup(version="1.0.0", install_requires=["click"])')
+        assert test.requirements_updated(tox, 'py3')
+        test._save_dependency_manifest(tox, 'py3')  # As done after redevelop
+
+        # Version change from bump / publish does not require a redevelop
+        with open('setup.py', 'w') as fp:
+            fp.write('setup(version="1.0.1", install_requires=["click"])')
+        assert not test.requirements_updated(tox, 'py3')
+
+
+def test_run_envs_in_parallel(monkeypatch, capsys):
+    monkeypatch.setattr(config.test, 'parallel_envs', '*')
+
+    with temp_dir() as tmpdir:
+        with open('tox.ini', 'w') as fp:
+            fp.write('[tox]\nenvlist = first, second\n\n'
+                     '[testenv:first]\ncommands =\n  hello first\n\n'
+                     '[testenv:second]\ncommands =\n  hello second\n  hello done\n')
+
+        for env in ['first', 'second']:
+            bin_dir = tmpdir / '.tox' / env / 'bin'
+            os.makedirs(str(bin_dir))
+            (bin_dir / 'activate').write_text('')
+            (bin_dir / 'hello').write_text('#!/bin/sh\necho "hello $1"\n[ "$1" != fail ]\n')
+            os.chmod(str(bin_dir / 'hello'), 0o755)
+
+        assert Test(repo=str(tmpdir)).run() == {'first': 'hello first', 'second': 'hello second\nhello done'}
+
+        out, _ = capsys.readouterr()
+        assert out.index('[ first ]') < out.index('hello first') < out.index('[ second ]') < out.index('hello done')
+        assert out.endswith('first: OK\nsecond: OK\n')
+
+        with pytest.raises(SystemExit):
+            Test(repo=str(tmpdir), tox_commands={'second': ['hello fail']}).run()
+
+        out, _ = capsys.readouterr()
+        assert out.endswith('first: OK\nsecond: FAILED\n')
+
+
+def test_format_requires_test_dependents(caplog):
+    with temp_dir() as tmpdir:
+        with pytest.raises(SystemExit):
+            Test(repo=str(tmpdir), format='json').run()
+
+    assert '--format json is only supported with -t / --test-dependents' in caplog.text
+
+
+def test_warm_runner(monkeypatch, tmpdir):
+    from workspace.warm_runner import WarmRunner
+
+    # Server is started with this, but the environment of the runs is replaced with the one passed in
+    monkeypatch.setenv('SAMPLE_SERVER', '1')
+
+    with temp_dir():
+        with open('requirements.txt', 'w') as fp:
+            fp.write('pytest\n')
+        with open('test_sample.py', 'w') as fp:
+            fp.write('import os\nimport sys\n\ndef test_pass():\n'
+                     '    assert os.environ["SAMPLE"] == "1" and "SAMPLE_SERVER" not in os.environ\n'
+                     '    assert os.path.dirname(sys.executable) in sys.path\n'
+                     '    assert not any(os.path.exists(os.path.join(p, "warm_runner.py")) for p in sys.path)\n')
+
+        runner = WarmRunner(sys.executable, watch_files=['requirements.txt'], preload=['pytest'],
+                            log_file=str(tmpdir / 'warm.log'))
+        assert oct(os.stat(os.path.dirname(runner.socket_path)).st_mode & 0o777) == oct(0o700)
+        chunks = []
+
+        try:
+            assert runner.run(['-q', 'test_sample.py'], cwd=os.getcwd(), env={'SAMPLE': '1'}, output=chunks.append) == 0
+            assert b'1 passed' in b''.join(chunks)
+
+            # Test changes are picked up by new workers
+            with open('test_sample.py', 'a') as fp:
+                fp.write('\ndef test_fail():\n    assert False\n')
+            assert runner.run(['-q', 'test_sample.py'], cwd=os.getcwd(), env={'SAMPLE': '1'}) == 1
+
+            # Restarted when dependencies change
+            with open('requirements.txt', 'w') as fp:
+                fp.write('pytest\nrequests\n')
+            del chunks[:]
+            assert runner.run(['-q', 'test_sample.py', '-k', 'pass'], cwd=os.getcwd(), env={'SAMPLE': '1'},
+                              output=chunks.append) == 0
+            assert b'1 passed, 1 deselected' in b''.join(chunks)
+
+        finally:
+            runner.stop()
+
+        assert not os.path.exists(runner.socket_path)
+
+
+def test_impact_analysis(monkeypatch):
+    monkeypatch.setattr(config.test, 'impact_analysis', '*')
+    monkeypatch.delenv('PYTHONPATH', raising=False)
+
+    with temp_git_repo() as repo:
+        files = {
+            '.gitignore': '.tox\n',
+            'tox.ini': '[tox]\nenvlist = py3\n\n[testenv]\ncommands = pytest -p no:cacheprovider {env:PYTESTARGS:}\n',
+            'first.py': 'def first():\n    return 1\n',
+            'second.py': 'def second():\n    return 2\n',
+            'test_first.py': 'from first import first\n\ndef test_first():\n    assert first() == 1\n',
+            'test_second.py': 'from second import second\n\ndef test_second():\n    assert second() == 2\n',
+        }
+        for name, content in files.items():
+            with open(name, 'w') as fp:
+                fp.write(content)
+        run('git add -A')
+        run('git commit -m Add')
+
+        bin_dir = repo / '.tox' / 'py3' / 'bin'
+        os.makedirs(str(bin_dir))
+        (bin_dir / 'activate').write_text('')
+        (bin_dir / 'pytest').write_text('#!/bin/sh\nexec {} -m pytest "$@"\n'.format(sys.executable))
+        os.chmod(str(bin_dir / 'pytest'), 0o755)
+        os.utime(str(repo / '.tox' / 'py3'), (time.time() + 10, time.time() + 10))
+
+        def run_tests():
+            return Test(repo=str(repo), return_output=True, silent=True).run()
+
+        assert '2 passed' in run_tests()
+        assert 'PYTHONPATH' not in os.environ  # Only set for the test commands
+        impact_file = str(repo / '.tox' / 'py3' / '.wst-test-impact.json')
+        with open(impact_file) as fp:
+            impact_map = json.load(fp)
+        assert sorted(impact_map['files']) == ['first.py', 'second.py', 'test_first.py', 'test_second.py']
+        assert sorted(impact_map['tests']) == ['test_first.py::test_first', 'test_second.py::test_second']
+
+        assert run_tests() is True  # No changes
+
+        with open('second.py', 'w') as fp:
+            fp.write('def second():\n    return 3\n')
+        output = run_tests()
+        assert '1 failed, 1 deselected' in output and 'test_second' in output
+
+        # Failed tests run until they pass
+        run('git checkout second.py')
+        assert '1 passed, 1 deselected' in run_tests()
+        assert run_tests() is True
+
+        with open('test_third.py', 'w') as fp:
+            fp.write('def test_third():\n    pass\n')
+        assert '1 passed, 2 deselected' in run_tests()
+
+        # All tests run when a changed file is not in the map
+        with open('data.txt', 'w') as fp:
+            fp.write('data\n')
+        assert '3 passed' in run_tests()
+        os.unlink('data.txt')
+
+        # All tests run when conftest.py changes
+        with open('conftest.py', 'w') as fp:
+            fp.write('\n')
+        assert '3 passed' in run_tests()
+
+
+def test_test_output(monkeypatch, tmpdir):
+    passed = ('============================= test session starts ==============================\n'
+              'collected 3 items\n\n'
+              'tests/test_a.py ..x                                                      [100%]\n\n'
+              '=================== 2 passed, 1 xfailed in 0.12s ===================\n')
+
+    test_output = TestOutput(str(tmpdir / 'passed.out'))
+    for i in range(0, len(passed), 7):  # Partial lines
+        test_output.feed(passed[i:i + 7])
+    test_output.close(0)
+
+    assert test_output.success
+    assert test_output.summary == '2 passed, 1 xfailed in 0.12s'
+    assert test_output.counts == {'passed': 2, 'xfailed': 1}
+    assert test_output.duration == 0.12
+    assert test_output.output_file is None
+    assert not os.path.exists(str(tmpdir / 'passed.out'))
+    assert Test.summarize(test_output) == (True, '2 passed, 1 xfailed in 0.12s')
+    assert Test.summarize(passed) == (True, '2 passed, 1 xfailed in 0.12s')
+
+    failed = ('============================= test session starts ==============================\n'
+              'tests/test_a.py::test_pass PASSED\n'
+              'tests/test_a.py::test_fail FAILED\n'
+              '=================================== FAILURES ===================================\n'
+              + 'E   assert False\n' * 100 +
+              '=========================== short test summary info ============================\n'
+              'FAILED tests/test_a.py::test_fail - assert False\n'
+              'ERROR tests/test_b.py - ImportError\n'
+              '============== 1 failed, 1 passed, 1 error, 2 warnings in 1.50s ===============')
+
+    test_output = TestOutput(str(tmpdir / 'failed.out'), tail_lines=3)
+    test_output.feed(failed)
+    test_output.close(1)
+
+    assert not test_output.success
+    assert test_output.counts == {'failed': 1, 'passed': 1, 'error': 1, 'warning': 2}
+    assert test_output.failed_tests == ['tests/test_a.py::test_fail', 'tests/test_b.py']
+    assert test_output.tail.startswith('FAILED tests/test_a.py::test_fail') and '1 failed' in test_output
+    assert test_output.output_file == str(tmpdir / 'failed.out')
+    assert (tmpdir / 'failed.out').read_text('utf-8') == failed + '\n'
+    assert Test.summarize(test_output) == (False, '1 failed, 1 passed, 1 error, 2 warnings in 1.50s')
+
+    # Large output is written to the output file as it comes in, and removed when tests pass
+    monkeypatch.setattr('workspace.commands.test.SPILL_BYTES', 100)
+    test_output = TestOutput(str(tmpdir / 'large.out'))
+    test_output.feed(passed)
+    assert os.path.exists(str(tmpdir / 'large.out'))
+    test_output.close(0)
+    assert test_output.success and not os.path.exists(str(tmpdir / 'large.out'))
+
+    test_output = TestOutput()
+    test_output.feed(passed)
+    assert not test_output.close(1).success
+    assert test_output.output_file is None
+
+
+def test_results_from_report(capsys):
+    with temp_git_repo() as repo:
+        with open('tox.ini', 'w') as fp:
+            fp.write('[tox]\nenvlist = py3\n\n[testenv]\ncommands = pytest -p no:cacheprovider {env:PYTESTARGS:}\n')
+        with open('test_sample.py', 'w') as fp:
+            fp.write('import time\n\nimport pytest\n\n\n'
+                     'def test_slow():\n    time.sleep(0.2)\n\n\n'
+                     'def test_pass():\n    pass\n\n\n'
+                     'def test_fail():\n    assert False\n\n\n'
+                     '@pytest.mark.skip\ndef test_skip():\n    pass\n\n\n'
+                     'class TestGroup:\n    def test_method(self):\n        pass\n')
+
+        bin_dir = repo / '.tox' / 'py3' / 'bin'
+        os.makedirs(str(bin_dir))
+        (bin_dir / 'activate').write_text('')
+        (bin_dir / 'pytest').write_text('#!/bin/sh\nexec {} -m pytest "$@"\n'.format(sys.executable))
+        os.chmod(str(bin_dir / 'pytest'), 0o755)
+        os.utime(str(repo / '.tox' / 'py3'), (time.time() + 10, time.time() + 10))
+
+        output = Test(repo=str(repo), return_output=True, silent=True).run()
+        assert output.summary.startswith('1 failed, 3 passed, 1 skipped in ')
+        assert output.counts == {'failed': 1, 'passed': 3, 'skipped': 1}
+        assert output.failed_tests == ['test_sample.py::test_fail']
+        assert output.slowest_tests[0]['test'] == 'test_sample.py::test_slow'
+        assert 'test_sample.py::TestGroup::test_method' in [t['test'] for t in output.slowest_tests]
+        assert output.slowest_tests[0]['duration'] >= 0.2
+        assert not output.success
+        assert Test.summarize(output) == (False, output.summary)
+
+        capsys.readouterr()
+        with pytest.raises(SystemExit):
+            Test(repo=str(repo), slowest=2).run()
+
+        out, _ = capsys.readouterr()
+        slowest = out[out.index('Slowest tests:'):].split('\n')
+        assert 'test_sample.py::test_slow' in slowest[1]
+
+        # No report when test results are not used
+        report_file = str(repo / '.tox' / 'py3' / '.wst-report.xml')
+        os.unlink(report_file)
+        with pytest.raises(SystemExit):
+            Test(repo=str(repo)).run()
+        assert not os.path.exists(report_file)
+
+        # Without the file attribute, the module ends before the class part
+        case = ElementTree.Element('testcase', classname='tests.test_a.TestA', name='test_x[1]')
+        assert TestOutput._test_id(case) == os.path.join('tests', 'test_a.py') + '::TestA::test_x[1]'
+        assert len(slowest) == 4 and not slowest[3]
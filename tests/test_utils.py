@@ -1,4 +1,15 @@
-from workspace.utils import shortest_id
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+from test_stubs import temp_dir
+
+from workspace.config import config
+from workspace.utils import (default_workers, invalidate_parent_paths, parallel_call, parallel_executor, parallel_map,
+                             parent_path_with_dir, parent_path_with_file, shortest_id)
 
 
 def test_shortest_id():
@@ -6,3 +17,92 @@ def test_shortest_id():
     assert shortest_id('apple', ['apricot', 'banana']) == 'app'
     assert shortest_id('apple', ['apple seed', 'banana']) == 'apple'
     assert shortest_id('apple', ['apple', 'banana']) == 'a'
+
+
+def test_parallel_map():
+    def slow_first(i):
+        time.sleep(0.1 if i == 0 else 0)
+        return i * 2
+
+    assert list(parallel_map(slow_first, range(5), workers=3)) == [0, 2, 4, 6, 8]
+    assert list(parallel_map(slow_first, [])) == []
+
+
+def double_or_fail(i):
+    if i < 0:
+        raise ValueError('negative')
+    return i * 2
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process', 'auto'])
+def test_parallel_call(executor):
+    completed_results = []
+    results = parallel_call(double_or_fail, [1, 2, -1, (3,)], callback=completed_results.append, workers=2,
+                            executor=executor)
+
+    assert results == {1: 2, 2: 4, -1: 'negative', (3,): 6}
+    assert sorted(completed_results) == [2, 4, 6]
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_parallel_call_interrupted(executor, tmpdir):
+    script = ('import signal, sys, time\n'
+              'from workspace.utils import parallel_call\n'
+              'signal.signal(signal.SIGINT, signal.default_int_handler)  # In case it is ignored by the test process\n'
+              'def call(i):\n'
+              '    open(sys.argv[1] + "/%s" % i, "w").close()\n'
+              '    time.sleep(1)\n'
+              'parallel_call(call, list(range(40)), workers=4, executor=sys.argv[2])\n')
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    process = subprocess.Popen([sys.executable, '-c', script, str(tmpdir), executor], env=env, start_new_session=True)
+    while len(tmpdir.listdir()) < 4:
+        time.sleep(0.05)
+
+    start = time.time()
+    process.send_signal(signal.SIGINT)
+    process.wait(timeout=10)
+
+    assert time.time() - start < 3
+    assert len(tmpdir.listdir()) < 10  # Queued calls are cancelled
+
+
+def test_parallel_executor(monkeypatch):
+    assert parallel_executor() == 'thread'
+    assert parallel_executor('process') == 'process'
+
+    monkeypatch.setattr(config.parallel, 'executor', 'process')
+    assert parallel_executor() == 'process'
+    assert parallel_executor('thread') == 'thread'
+
+    with pytest.raises(ValueError):
+        parallel_executor('fork')
+
+
+def test_default_workers(monkeypatch):
+    assert default_workers(1) == 1
+    assert 1 < default_workers(1000) <= 1000
+
+    monkeypatch.setattr(config.parallel, 'workers', 3)
+    assert default_workers(1000) == 3
+    assert default_workers(2) == 2
+
+
+def test_parent_path_with_dir():
+    with temp_dir() as tmpdir:
+        os.makedirs('a/b/c')
+        os.makedirs('a/.marker')
+
+        assert parent_path_with_dir('.marker', str(tmpdir / 'a/b/c')) == str(tmpdir / 'a')
+        assert parent_path_with_dir('.marker', str(tmpdir / 'a/b')) == str(tmpdir / 'a')
+        assert parent_path_with_file('.marker', str(tmpdir / 'a/b')) is False
+
+        os.makedirs('a/b/.marker')
+        assert parent_path_with_dir('.marker', str(tmpdir / 'a/b/c')) == str(tmpdir / 'a')  # Cached
+
+        invalidate_parent_paths()
+        assert parent_path_with_dir('.marker', str(tmpdir / 'a/b/c')) == str(tmpdir / 'a/b')
+
+        os.chdir('a/b/c')  # Cache is cleared when cwd changes
+        os.rmdir(str(tmpdir / 'a/b/.marker'))
+        assert parent_path_with_dir('.marker') == str(tmpdir / 'a')
@@ -1,13 +1,18 @@
 from __future__ import absolute_import
 import logging
 import os
+import sys
 
 import click
 
 from workspace.commands import AbstractCommand
 from workspace.commands.helpers import expand_product_groups
+from workspace.config import config
 from workspace.scm import (checkout_product, checkout_branch, all_branches, checkout_files, is_repo,
-                           product_checkout_path, product_name, upstream_remote, all_remotes, update_tags)
+                           product_checkout_path, product_name, upstream_remote, all_remotes, update_tags,
+                           resolve_product_urls, SCMError)
+from workspace.utils import parallel_call
+
 log = logging.getLogger(__name__)
 
 
@@ -17,6 +22,7 @@ class Checkout(AbstractCommand):
 
       :param list target: List of products (git repository URLs) to checkout. When inside a git repo,
                           checkout the branch or revert changes for file(s).
+                          New products are cloned using [checkout] clone_strategy / clone_strategies config.
     """
     alias = 'co'
 
@@ -56,11 +62,10 @@ class Checkout(AbstractCommand):
             checkout_files(self.target)
             return
 
-        product_urls = expand_product_groups(self.target)
-
-        for product_url in product_urls:
-            product_url = product_url.strip('/')
+        product_urls = [product_url.strip('/') for product_url in expand_product_groups(self.target)]
 
+        if len(product_urls) == 1:
+            product_url = product_urls[0]
             product_path = product_checkout_path(product_url)
 
             if os.path.exists(product_path):
@@ -68,4 +73,71 @@ class Checkout(AbstractCommand):
             else:
                 click.echo('Checking out ' + product_url)
 
-            checkout_product(product_url, product_path)
+            try:
+                checkout_product(product_url, product_path, clone_strategy=self.clone_strategy(product_url))
+            except SCMError as e:
+                log.error(e)
+                sys.exit(1)
+
+            return
+
+        self._checkout_products(product_urls)
+
+    @staticmethod
+    def clone_strategy(product_url):
+        """ Clone strategy for the product from [checkout] clone_strategies config, or None to use the default one """
+        name = product_name(product_url)
+
+        for product_strategy in (config.checkout.clone_strategies or '').split():
+            products, _, strategy = product_strategy.partition('=')
+            if name in [product_name(p) for p in expand_product_groups([products])]:
+                return strategy
+
+    def _checkout_products(self, product_urls):
+        """ Checkout / update the products in parallel, and then show a summary of the ones that failed. """
+        product_paths = dict((url, product_checkout_path(url)) for url in product_urls)
+        errors = {}
+
+        # Resolve urls before any clone starts so a lookup error does not leave a partial checkout behind
+        new_products = [url for url in product_urls if not os.path.exists(product_paths[url])]
+        if new_products:
+            click.echo('Resolving {} product url(s)'.format(len(new_products)))
+        resolved_urls = resolve_product_urls(new_products)
+
+        checkout_args = []
+        for product_url in product_urls:
+            resolved_url = resolved_urls.get(product_url, product_url)
+            if isinstance(resolved_url, SCMError):
+                errors[product_name(product_url)] = resolved_url
+            else:
+                checkout_args.append((resolved_url, product_paths[product_url], self.clone_strategy(product_url)))
+
+        def checkout_done(result):
+            name, action, error = result
+            if error:
+                errors[name] = error
+                log.error('%s: %s failed', name, action)
+            else:
+                click.echo('{}: {}'.format(name, action))
+
+        click.echo('Checking out / updating {} product(s)'.format(len(checkout_args)))
+        parallel_call(_checkout_product, checkout_args, callback=checkout_done, executor='thread')
+
+        if errors:
+            click.echo('\nFailed to checkout / update {} product(s):'.format(len(errors)))
+            for name in sorted(errors):
+                click.echo('    {}: {}'.format(name, str(errors[name]).strip()))
+            sys.exit(1)
+
+
+def _checkout_product(product_url, product_path, clone_strategy=None):
+    """ Checkout / update the product quietly, and return a tuple of (name, action, error) """
+    name = product_name(product_path)
+    action = 'Updated' if os.path.exists(product_path) else 'Checked out'
+
+    try:
+        checkout_product(product_url, product_path, quiet=True, clone_strategy=clone_strategy)
+        return name, action, None
+
+    except Exception as e:
+        return name, 'Update' if action == 'Updated' else 'Checkout', e
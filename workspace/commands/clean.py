@@ -2,6 +2,8 @@ from __future__ import absolute_import
 import logging
 import os
 import shutil
+import subprocess
+import sys
 from time import time
 
 import click
@@ -10,23 +12,30 @@ from utils.process import silent_run
 from workspace.commands import AbstractCommand
 from workspace.commands.helpers import expand_product_groups
 from workspace.config import config
-from workspace.scm import workspace_path, product_name, repos, stat_repo, all_branches, repo_path
+from workspace.scm import workspace_path, workspace_index, clean_state, repo_path
+from workspace.utils import invalidate_parent_paths, parallel_map
 
 log = logging.getLogger(__name__)
 
+#: Dir in workspace that removed products are moved to before they are deleted in the background
+TRASH_DIR = '.wst-trash'
+
 
 class Clean(AbstractCommand):
     """
     Clean workspace by removing build, dist, and .pyc files
 
     :param bool force: Remove untracked files too.
+    :param bool dry_run: Show products that would be removed and the disk space that would be reclaimed without
+                         removing them.
     """
 
     @classmethod
     def arguments(cls):
         _, docs = cls.docs()
         return [
-          cls.make_args('-f', '--force', action='store_true', help=docs['force'])
+          cls.make_args('-f', '--force', action='store_true', help=docs['force']),
+          cls.make_args('-n', '--dry-run', action='store_true', help=docs['dry_run'])
         ]
 
     def run(self):
@@ -47,6 +56,11 @@ class Clean(AbstractCommand):
             path = workspace_path()
             click.echo('Cleaning {}'.format(path))
 
+            # Each run moves products into its own dir in trash, so concurrent runs only delete their own products
+            trash_dir = os.path.join(path, TRASH_DIR)
+            run_trash_dir = os.path.join(trash_dir, str(int(time() * 1000)))
+            retry_trash_dirs = check_trash(trash_dir)
+
             if config.clean.remove_products_older_than_days or config.clean.remove_all_products_except:
                 keep_time = 0
                 keep_products = []
@@ -60,19 +74,178 @@ class Clean(AbstractCommand):
                     keep_time = time() - config.clean.remove_products_older_than_days * 86400
 
                 removed_products = []
+                candidates = []
 
-                for repo in repos(path):
-                    name = product_name(repo)
+                for checkout in workspace_index().entries(path):
+                    repo, name = checkout['path'], checkout['name']
                     modified_time = os.stat(repo).st_mtime
                     if keep_products and name not in keep_products or keep_time and modified_time < keep_time:
-                        status = stat_repo(repo, return_output=True)
-                        if (not status or 'nothing to commit' in status and
-                                ('working directory clean' in status or 'working tree clean' in status) and
-                                len(all_branches(repo)) <= 1):
-                            shutil.rmtree(repo)
-                            removed_products.append(name)
-                        else:
-                            click.echo('  - Skipping "%s" as it has changes that may not be committed' % name)
-
-                if removed_products:
+                        candidates.append(checkout)
+
+                # Candidates are checked in parallel as the checks only read repo state
+                states = parallel_map(clean_state, [checkout['path'] for checkout in candidates])
+
+                remove_repos = []
+
+                for checkout, state in zip(candidates, states):
+                    repo, name = checkout['path'], checkout['name']
+                    if state['clean'] and len(state['branches']) <= 1:
+                        remove_repos.append(repo)
+                        removed_products.append(name)
+                    elif 'error' in state:
+                        click.echo('  - Skipping "%s" as its status could not be checked: %s' % (name, state['error']))
+                    else:
+                        click.echo('  - Skipping "%s" as it has changes that may not be committed' % name)
+
+                if self.dry_run:
+                    total_size = 0
+                    for name, size in zip(removed_products, parallel_map(dir_size, remove_repos)):
+                        click.echo('  - Would remove "{}" ({})'.format(name, human_size(size)))
+                        total_size += size
+                    click.echo('Would reclaim ' + human_size(total_size))
+
+                elif removed_products:
+                    # Moving to trash is instant, so the workspace is cleaned right away and the slow delete
+                    # happens in the background.
+                    for repo in remove_repos:
+                        move_to_trash(repo, run_trash_dir)
+
+                    invalidate_parent_paths()
                     click.echo('Removed ' + ', '.join(removed_products))
+
+            if not self.dry_run:
+                trash_dirs = retry_trash_dirs + ([run_trash_dir] if os.path.isdir(run_trash_dir) else [])
+                if trash_dirs:
+                    entries = sum(empty_trash(d) for d in trash_dirs)
+                    click.echo('Deleting {} entries in the background from {} (errors are shown on next clean)'
+                               .format(entries, trash_dir))
+
+
+def dir_size(path):
+    """ Total size of files in the path in bytes """
+    size = 0
+
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+
+    return size
+
+
+def human_size(size):
+    """ Size in bytes as a human readable string, e.g. 1.5 GB """
+    for unit in ['bytes', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024.0
+
+    return '{} {}'.format(size, unit) if unit == 'bytes' else '{:.1f} {}'.format(size, unit)
+
+
+def move_to_trash(path, trash_dir):
+    """ Move path into trash dir (on the same file system, so it is instant), or remove it if it can't be moved """
+    try:
+        if not os.path.exists(trash_dir):
+            os.makedirs(trash_dir)
+        os.rename(path, os.path.join(trash_dir, os.path.basename(path)))
+
+    except OSError as e:
+        log.debug('Could not move %s to trash, so removing it now: %s', path, e)
+        shutil.rmtree(path)
+
+
+def trash_log(run_trash_dir):
+    """ Log file with the errors of the background delete of the trash dir of a run that did not delete everything """
+    return run_trash_dir + '.log'
+
+
+def empty_trash(run_trash_dir):
+    """
+    Delete the trash dir of a run in a background process that continues after wst exits. See :func:`delete_trash`.
+
+    :return: Number of entries in trash to be deleted
+    """
+    # Imports of the background process only need the workspace package and the standard library
+    package_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    script = ('import sys; sys.path.insert(0, sys.argv[1]); '
+              'from workspace.commands.clean import delete_trash; delete_trash(sys.argv[2])')
+
+    # Log of an earlier delete is removed, so other runs do not retry it too
+    if os.path.exists(trash_log(run_trash_dir)):
+        os.unlink(trash_log(run_trash_dir))
+
+    entries = len(os.listdir(run_trash_dir))
+    subprocess.Popen([sys.executable, '-c', script, package_dir, run_trash_dir],
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+    return entries
+
+
+def delete_trash(run_trash_dir):
+    """
+    Delete the entries in the trash dir of a run, then the dir itself, and then the parent trash dir if it is empty.
+    Errors are written to :func:`trash_log` when any entry could not be deleted, so they can be shown by
+    :func:`check_trash` on the next clean.
+    """
+    errors = []
+
+    def log_error(func, path, exc_info):
+        errors.append('Could not delete {}: {}'.format(path, exc_info[1]))
+
+    for name in sorted(os.listdir(run_trash_dir)):
+        shutil.rmtree(os.path.join(run_trash_dir, name), onerror=log_error)
+
+    log_file = trash_log(run_trash_dir)
+    entries_left = os.listdir(run_trash_dir)
+
+    if entries_left:
+        with open(log_file, 'w') as fp:
+            fp.write('\n'.join(errors + ['{} entries left in {}'.format(len(entries_left), run_trash_dir)]) + '\n')
+        return
+
+    os.rmdir(run_trash_dir)
+    if os.path.exists(log_file):
+        os.unlink(log_file)
+
+    try:
+        os.rmdir(os.path.dirname(run_trash_dir))
+    except OSError:
+        pass  # Not empty as another run is using it
+
+
+def check_trash(trash_dir):
+    """
+    Show the errors of earlier background deletes in the trash dir that did not delete everything
+
+    :return: List of trash dirs of the runs with errors, so their delete can be retried
+    """
+    if not os.path.isdir(trash_dir):
+        return []
+
+    retry_dirs = []
+
+    for name in sorted(os.listdir(trash_dir)):
+        log_file = os.path.join(trash_dir, name)
+        run_trash_dir = log_file[:-len('.log')]
+        if not name.endswith('.log'):
+            continue
+
+        if not os.path.isdir(run_trash_dir):
+            os.unlink(log_file)
+            continue
+
+        with open(log_file) as fp:
+            lines = fp.read().strip().split('\n')
+
+        log.warning('Earlier background delete of removed products did not complete: %s', lines[-1])
+        for line in lines[:-1]:
+            log.warning('  %s', line)
+        retry_dirs.append(run_trash_dir)
+
+    if retry_dirs:
+        log.warning('Please check the errors above. Delete will be retried, or delete the remaining entries manually.')
+
+    return retry_dirs
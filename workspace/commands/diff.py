@@ -3,9 +3,9 @@ import logging
 import os
 
 from workspace.commands import AbstractCommand
-from workspace.commands.helpers import ProductPager
-from workspace.scm import diff_repo, repos, product_name, current_branch, parent_branch
-from workspace.utils import log_exception
+from workspace.commands.helpers import OUTPUT_FORMATS, ProductPager, RecordWriter
+from workspace.scm import diff_repo, diff_stats, repos, product_name, current_branch, parent_branch
+from workspace.utils import log_exception, parallel_map
 
 log = logging.getLogger(__name__)
 
@@ -17,6 +17,9 @@ class Diff(AbstractCommand):
       :param str context: Show diff for context (i.e. branch or file)
       :param bool parent: Diff against the parent branch. If there is not parent, defaults to master.
       :param bool name_only: List file names only. Git only.
+      :param str format: Output format. With json or ndjson, a record with the product, path, branch, and files
+                         (list of path, added, and deleted lines) is written for each product with changes
+                         (in order) as soon as it is ready.
     """
     alias = 'di'
 
@@ -26,7 +29,8 @@ class Diff(AbstractCommand):
         return [
           cls.make_args('context', nargs='?', help=docs['context']),
           cls.make_args('-p', '--parent', action='store_true', help=docs['parent']),
-          cls.make_args('-l', '--name-only', action='store_true', help=docs['name_only'])
+          cls.make_args('-l', '--name-only', action='store_true', help=docs['name_only']),
+          cls.make_args('--format', choices=OUTPUT_FORMATS, default='text', help=docs['format'])
         ]
 
     def run(self):
@@ -35,6 +39,9 @@ class Diff(AbstractCommand):
         else:
             scm_repos = repos()
 
+        if self.format and self.format != 'text':
+            return self._write_records(scm_repos)
+
         optional = len(scm_repos) == 1
         pager = ProductPager(optional=optional)
 
@@ -49,3 +56,19 @@ class Diff(AbstractCommand):
                     pager.write(product_name(repo), output, cur_branch)
 
         pager.close_and_wait()
+
+    def _write_records(self, scm_repos):
+        def repo_record(repo):
+            cur_branch = current_branch(repo)
+            branch = (parent_branch(cur_branch) or 'master') if self.parent else None
+            return {'product': product_name(repo), 'path': repo, 'branch': cur_branch,
+                    'files': diff_stats(repo, branch=branch, context=self.context)}
+
+        writer = RecordWriter(self.format)
+
+        try:
+            for record in parallel_map(repo_record, scm_repos):
+                if record['files']:
+                    writer.write(record)
+        finally:
+            writer.close()
@@ -1,21 +1,35 @@
+import json
 import logging
 import os
 import re
 import subprocess
+import sys
+import threading
 
 from localconfig import LocalConfig
 
-from workspace.config import product_groups
-from workspace.scm import project_path
+from workspace.config import config, product_groups, CACHE_DIR
+from workspace.scm import project_path, workspace_index
 
 log = logging.getLogger(__name__)
 
+#: Output formats for commands that support machine readable output. See :class:`RecordWriter`
+OUTPUT_FORMATS = ['text', 'json', 'ndjson']
+
 
 class ToxIni(LocalConfig):
-    """ Represents tox.ini """
+    """
+    Represents tox.ini
+
+    Use :meth:`for_path` to get a shared instance that is only parsed again when tox.ini changes.
+    Env settings (see :meth:`env`) and expanded values are computed once per instance.
+    """
 
     VAR_RE = re.compile(r'{(\w+)}')
 
+    _instances = {}
+    _instances_lock = threading.Lock()
+
     def __init__(self, path=None, tox_ini=None):
         """
         :param str path: The path to load tox*.ini from.
@@ -29,6 +43,32 @@ class ToxIni(LocalConfig):
         # These must be set after super() otherwise there will be recursion error
         self.tox_ini = tox_ini
         self.path = path or os.path.dirname(tox_ini)
+        self._envs = None
+        self._expansions = {}
+
+    @classmethod
+    def for_path(cls, path=None, tox_ini=None):
+        """
+        Returns a cached :class:`ToxIni` for the path, which is reloaded when tox.ini has changed (mtime or size).
+        Parameters are the same as :meth:`__init__`.
+        """
+        if not tox_ini:
+            tox_ini = cls.find_tox_ini(path)
+
+        try:
+            tox_stat = os.stat(tox_ini)
+        except OSError:
+            return cls(path, tox_ini)
+
+        key = (os.path.abspath(tox_ini), path)
+        signature = (tox_stat.st_mtime_ns, tox_stat.st_size)
+
+        with cls._instances_lock:
+            cached = cls._instances.get(key)
+            if not cached or cached[0] != signature:
+                cls._instances[key] = cached = signature, cls(path, tox_ini)
+
+        return cached[1]
 
     @classmethod
     def find_tox_ini(cls, path):
@@ -71,31 +111,267 @@ class ToxIni(LocalConfig):
     def homedir(self):
         return os.path.expanduser('~')
 
-    def envdir(self, env):
-        default_envdir = os.path.join('{toxworkdir}', env)
-        default_envsection = self.envsection()
-        default_envdir = self.get(default_envsection, 'envdir', default_envdir)
+    @property
+    def envs(self):
+        """ Map of env name (from envlist and testenv sections) to its settings. See :meth:`env` """
+        if self._envs is None:
+            self._read_sources()
+            names = set(self.envlist)
+            names.update(s.split(':', 1)[1] for s in self._parser.sections() if s.startswith('testenv:'))
+            self._envs = dict((name, self._env_settings(name)) for name in names)
+
+        return self._envs
+
+    def env(self, env):
+        """ Dict of envdir, bindir, commands, and basepython settings for the env """
+        if env not in self.envs:
+            self.envs[env] = self._env_settings(env)
+
+        return self.envs[env]
+
+    def _env_settings(self, env):
         envsection = self.envsection(env)
-        envdir = self.get(envsection, 'envdir', default_envdir)
-        return self.expand_vars(envdir, {'envname': env})
+
+        default_envdir = self.get(self.envsection(), 'envdir', os.path.join('{toxworkdir}', env))
+        envdir = self.expand_vars(self.get(envsection, 'envdir', default_envdir), {'envname': env})
+
+        commands = self.get(envsection, 'commands', self.get('testenv', 'commands', 'pytest {env:PYTESTARGS:}'))
+        commands = [_f for _f in self.expand_vars(commands.replace('\\\n', '')).split('\n') if _f]
+
+        return {'envdir': envdir,
+                'bindir': os.path.join(envdir, 'bin'),
+                'commands': commands,
+                'basepython': self.get(envsection, 'basepython', self.get('testenv', 'basepython'))}
+
+    def envdir(self, env):
+        return self.env(env)['envdir']
 
     def bindir(self, env, script=None):
-        dir = os.path.join(self.envdir(env), 'bin')
+        dir = self.env(env)['bindir']
         if script:
             dir = os.path.join(dir, script)
         return dir
 
     def commands(self, env):
-        envsection = self.envsection(env)
-        commands = self.get(envsection, 'commands', self.get('testenv', 'commands', 'pytest {env:PYTESTARGS:}'))
-        commands = commands.replace('\\\n', '')
-        return [_f for _f in self.expand_vars(commands).split('\n') if _f]
-
-    def expand_vars(self, value, extra_vars={}):
-        if '{' in value:
-            value = self.VAR_RE.sub(lambda m: extra_vars.get(
-                m.group(1), getattr(self, m.group(1), m.group(0)) or getattr(self, m.group(1)[3:], m.group(0))), value)
-        return value
+        return list(self.env(env)['commands'])
+
+    def expand_vars(self, value, extra_vars=None):
+        if '{' not in value:
+            return value
+
+        # Split into literal text and var names once per value, so only the var lookups are done on each call
+        if value not in self._expansions:
+            self._expansions[value] = self.VAR_RE.split(value)
+        parts = self._expansions[value]
+
+        extra_vars = extra_vars or {}
+        expanded = []
+
+        for i, part in enumerate(parts):
+            if i % 2:  # Var name
+                var = '{%s}' % part
+                part = extra_vars.get(part, getattr(self, part, var) or getattr(self, part[3:], var))
+            expanded.append(part)
+
+        return ''.join(expanded)
+
+
+def requirement_names(path):
+    """
+    Names of requirements (normalized by :func:`normalize_name`) in the requirement files (bump.requirement_files
+    in workspace.cfg) of the product at path.
+    """
+    import pkg_resources
+
+    names = set()
+
+    for req_file in config.bump.requirement_files.split():
+        req_path = os.path.join(path, req_file)
+        if os.path.exists(req_path):
+            with open(req_path) as fp:
+                try:
+                    names.update(normalize_name(r.project_name) for r in pkg_resources.parse_requirements(fp.read()))
+                except Exception as e:
+                    log.debug('Could not parse %s: %s', req_path, e)
+
+    return names
+
+
+def normalize_name(name):
+    """ Normalize product / requirement name so they can be compared """
+    return name.lower().replace('_', '-')
+
+
+class DependencyGraph(object):
+    """
+    Graph of products in a workspace and the products that they depend on based on their requirement files.
+
+    Use :meth:`for_workspace` to get a cached graph, which is only rebuilt when a product is added / removed or
+    any of the requirement files has changed. The dependencies are also saved in dependency_graphs.json in
+    :data:`CACHE_DIR` keyed by workspace and the signature of the requirement files, so the requirement files are
+    only parsed again in the next run when they change.
+    """
+    _graphs = {}
+    _lock = threading.Lock()
+
+    def __init__(self, products, dependencies=None):
+        """
+        :param dict products: Map of product name to path to build graph for
+        :param dict dependencies: Map of product name to list of product names that it depends on from a previous
+                                  build of the graph for the same products. Built from the requirement files if not set.
+        """
+        self.products = products
+
+        if dependencies is None:
+            names = dict((normalize_name(n), n) for n in products)
+            dependencies = dict((name, set(names[r] for r in requirement_names(path) if r in names) - {name})
+                                for name, path in products.items())
+
+        #: Map of product name to set of product names that it depends on (only products in the graph)
+        self.dependencies = dict((name, set(deps)) for name, deps in dependencies.items())
+
+    @classmethod
+    def _signature(cls, products):
+        """ List of [product path, requirement file, mtime] for the products (JSON serializable) """
+        signature = []
+
+        for name, path in sorted(products.items()):
+            signature.append([path, None, None])
+            for req_file in config.bump.requirement_files.split():
+                try:
+                    signature.append([path, req_file, os.stat(os.path.join(path, req_file)).st_mtime_ns])
+                except OSError:
+                    pass
+
+        return signature
+
+    @classmethod
+    def _cache_file(cls):
+        return os.path.expanduser(os.path.join(CACHE_DIR, 'dependency_graphs.json'))
+
+    @classmethod
+    def _load(cls, workspace_dir, signature):
+        """ Dependencies saved for the workspace if they were built with the same signature, or None """
+        try:
+            with open(cls._cache_file()) as fp:
+                saved = json.load(fp).get(workspace_dir)
+        except Exception as e:
+            log.debug('Could not load dependency graphs: %s', e)
+            return None
+
+        if saved and saved['signature'] == signature:
+            return saved['dependencies']
+
+    @classmethod
+    def _save(cls, workspace_dir, signature, graph):
+        cache_file = cls._cache_file()
+
+        try:
+            try:
+                with open(cache_file) as fp:
+                    graphs = json.load(fp)
+            except Exception:
+                graphs = {}
+
+            graphs = dict((w, g) for w, g in graphs.items() if os.path.isdir(w))
+            graphs[workspace_dir] = {'signature': signature,
+                                     'dependencies': dict((n, sorted(d)) for n, d in graph.dependencies.items())}
+
+            if not os.path.exists(os.path.dirname(cache_file)):
+                os.makedirs(os.path.dirname(cache_file))
+
+            temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            with open(temp_file, 'w') as fp:
+                json.dump(graphs, fp)
+            os.rename(temp_file, cache_file)
+
+        except Exception as e:
+            log.debug('Could not save dependency graphs: %s', e)
+
+    @classmethod
+    def for_workspace(cls, workspace_dir):
+        """ Returns cached :class:`DependencyGraph` for the workspace """
+        workspace_dir = os.path.abspath(workspace_dir)
+        products = workspace_index().products(workspace_dir)
+        signature = cls._signature(products)
+
+        with cls._lock:
+            cached = cls._graphs.get(workspace_dir)
+            if not cached or cached[0] != signature:
+                dependencies = cls._load(workspace_dir, signature)
+                graph = cls(products, dependencies)
+                if dependencies is None:
+                    cls._save(workspace_dir, signature, graph)
+                cls._graphs[workspace_dir] = cached = signature, graph
+
+        return cached[1]
+
+    def dependents(self, name, transitive=True):
+        """ Set of product names that depends on the given product directly, or transitively too """
+        dependents = set()
+        names = [name]
+
+        while names:
+            current = names.pop()
+            for dependent, dependencies in self.dependencies.items():
+                if current in dependencies and dependent not in dependents:
+                    dependents.add(dependent)
+                    if transitive:
+                        names.append(dependent)
+
+        dependents.discard(name)
+
+        return dependents
+
+    def waves(self, names):
+        """
+        Group the products into waves in topological order, where products in a wave only depend on products in
+        earlier waves. Products with circular dependencies are put in the last wave.
+
+        :param iterable names: Product names to group
+        :return: List of sorted list of product names for each wave
+        """
+        remaining = set(names)
+        waves = []
+
+        while remaining:
+            wave = sorted(n for n in remaining if not self.dependencies.get(n, set()) & remaining)
+            if not wave:
+                wave = sorted(remaining)
+            waves.append(wave)
+            remaining -= set(wave)
+
+        return waves
+
+
+class RecordWriter(object):
+    """
+    Write records (dicts) as a JSON array or as one JSON object per line (ndjson). Each record is written and flushed
+    as soon as it is ready, so a consumer can process a record without waiting for the rest.
+    """
+
+    def __init__(self, format='ndjson', fp=None):
+        """
+        :param str format: json or ndjson
+        :param file fp: File to write to. Defaults to stdout.
+        """
+        self.format = format
+        self.fp = fp or sys.stdout
+        self.count = 0
+
+    def write(self, record):
+        if self.format == 'json':
+            self.fp.write('[\n' if not self.count else ',\n')
+            self.fp.write(json.dumps(record, sort_keys=True))
+        else:
+            self.fp.write(json.dumps(record, sort_keys=True) + '\n')
+        self.fp.flush()
+        self.count += 1
+
+    def close(self):
+        if self.format == 'json':
+            self.fp.write('\n]\n' if self.count else '[]\n')
+            self.fp.flush()
 
 
 class ProductPager(object):
@@ -5,11 +5,10 @@ import sys
 import textwrap
 
 import click
-import git
-from utils.process import run as process_run
+from utils.process import run as process_run, silent_run
 from workspace.commands import AbstractCommand
 from workspace.config import config
-from workspace.scm import checkout_branch, current_branch, merge_branch, repo_path
+from workspace.scm import checkout_branch, current_branch, merge_branch, repo_path, repo_state
 
 log = logging.getLogger(__name__)
 
@@ -57,13 +56,13 @@ class Merge(AbstractCommand):
 
     def run(self):
         current = current_branch()
-        repo = git.Repo(path=repo_path())
+        repo = repo_path()
 
         if self.branch and self.downstreams:
             log.error('Branch and --downstreams are mutually exclusive. Please use one or the other.')
             sys.exit(1)
 
-        if repo.is_dirty(untracked_files=True):
+        if repo_state(repo).dirty:
             log.error(
                 'Your repo has untracked or modified files in working dir or in staging index. Please cleanup before doing merge')
             sys.exit(1)
@@ -204,4 +203,5 @@ class Merge(AbstractCommand):
         return commits
 
     def _unmerged_commits(self, repo, from_branch, target_branch):
-        return repo.git.log('{}..{}'.format(target_branch, from_branch), oneline=True)
\ No newline at end of file
+        return silent_run(['git', 'log', '--oneline', '{}..{}'.format(target_branch, from_branch)], cwd=repo,
+                          return_output=True).strip()
\ No newline at end of file
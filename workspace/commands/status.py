@@ -3,46 +3,79 @@ import os
 import logging
 
 from workspace.commands import AbstractCommand
-from workspace.commands.helpers import ProductPager
-from workspace.scm import stat_repo, repos, product_name, all_branches, is_repo, all_remotes
+from workspace.commands.helpers import OUTPUT_FORMATS, ProductPager, RecordWriter
+from workspace.scm import stat_repo, repos, product_name, all_branches, is_repo, all_remotes, repo_status
+from workspace.utils import parallel_map
 
 log = logging.getLogger(__name__)
 
 
 class Status(AbstractCommand):
-    """ Show status on current product or all products in workspace """
+    """
+      Show status on current product or all products in workspace
+
+      :param str format: Output format. With json or ndjson, a status record is written for each product (in order)
+                         as soon as it is ready. See :func:`workspace.scm.repo_status` for the record fields.
+    """
     alias = 'st'
 
+    @classmethod
+    def arguments(cls):
+        _, docs = cls.docs()
+        return [cls.make_args('--format', choices=OUTPUT_FORMATS, default='text', help=docs['format'])]
+
     def run(self):
+        scm_repos = repos()
+
+        if self.format and self.format != 'text':
+            return self._write_records(scm_repos)
+
+        in_repo = is_repo(os.getcwd())
+        optional = len(scm_repos) == 1
+        pager = ProductPager(optional=optional)
+
+        def status_output(repo):
+            stat_path = os.getcwd() if in_repo else repo
+
+            # Full status is only needed to show changes, which most repos in a workspace don't have
+            nothing_to_commit = repo_status(stat_path)['clean']
+            output = '' if nothing_to_commit else stat_repo(stat_path, return_output=True, with_color=True)
+
+            branches = all_branches(repo, verbose=True)
+            child_branches = [b for b in branches if '@' in b]
+
+            if len(child_branches) >= 1 or len(scm_repos) == 1:
+                show_branches = branches if len(scm_repos) == 1 else child_branches
+                remotes = all_remotes() if len(scm_repos) == 1 else []
+                remotes = '\n# Remotes: {}'.format(' '.join(remotes)) if len(remotes) > 1 else ''
+
+                if nothing_to_commit:
+                    output = '# Branches: {}{}'.format(' '.join(show_branches), remotes)
+                    nothing_to_commit = False
+                elif len(show_branches) > 1:
+                    output = '# Branches: {}{}\n#\n{}'.format(' '.join(show_branches), remotes, output)
+
+            if output and not nothing_to_commit:
+                return output
 
         try:
-            scm_repos = repos()
-            in_repo = is_repo(os.getcwd())
-            optional = len(scm_repos) == 1
-            pager = ProductPager(optional=optional)
-
-            for repo in scm_repos:
-                stat_path = os.getcwd() if in_repo else repo
-                output = stat_repo(stat_path, return_output=True, with_color=True)
-                nothing_to_commit = ('nothing to commit' in output and
-                                     'Your branch is ahead of' not in output and
-                                     'Your branch is behind' not in output)
-
-                branches = all_branches(repo, verbose=True)
-                child_branches = [b for b in branches if '@' in b]
-
-                if len(child_branches) >= 1 or len(scm_repos) == 1:
-                    show_branches = branches if len(scm_repos) == 1 else child_branches
-                    remotes = all_remotes() if len(scm_repos) == 1 else []
-                    remotes = '\n# Remotes: {}'.format(' '.join(remotes)) if len(remotes) > 1 else ''
-
-                    if nothing_to_commit:
-                        output = '# Branches: {}{}'.format(' '.join(show_branches), remotes)
-                        nothing_to_commit = False
-                    elif len(show_branches) > 1:
-                        output = '# Branches: {}{}\n#\n{}'.format(' '.join(show_branches), remotes, output)
-
-                if output and not nothing_to_commit:
+            # Repos are checked in parallel, but written in order as soon as each repo's turn comes up
+            for repo, output in zip(scm_repos, parallel_map(status_output, scm_repos)):
+                if output:
                     pager.write(product_name(repo), output)
         finally:
             pager.close_and_wait()
+
+    def _write_records(self, scm_repos):
+        def repo_record(repo):
+            record = repo_status(repo)
+            record.update(product=product_name(repo), path=repo, branches=all_branches(repo))
+            return record
+
+        writer = RecordWriter(self.format)
+
+        try:
+            for record in parallel_map(repo_record, scm_repos):
+                writer.write(record)
+        finally:
+            writer.close()
@@ -1,28 +1,305 @@
 from __future__ import absolute_import
 from __future__ import print_function
 import argparse
+import codecs
+from collections import deque
+import hashlib
 import logging
 import os
-import pkg_resources
 import re
+import shlex
+import subprocess
 import sys
 import tempfile
+from xml.etree import ElementTree
 
 import click
 import json
-from utils.process import run
+from utils.process import run, silent_run
 
 from workspace.commands import AbstractCommand
-from workspace.commands.helpers import expand_product_groups, ToxIni
+from workspace.commands.helpers import (expand_product_groups, requirement_names, DependencyGraph,
+                                        OUTPUT_FORMATS, RecordWriter, ToxIni)
+from workspace.commands.publish import VERSION_RE
 from workspace.config import config
-from workspace.scm import (product_name, repo_path, product_repos, product_path, repos,
-                           workspace_path, current_branch, project_path)
-from workspace.utils import log_exception, parallel_call
+from workspace.scm import (product_name, repo_path, product_repos, product_path, workspace_path, current_branch,
+                           project_path, all_branches, diff_repo, master_branch, parent_branch, repo_status)
+from workspace.utils import default_workers, log_exception, parallel_call, parallel_map
 
 log = logging.getLogger(__name__)
 
-TEST_RE = re.compile('\d+ (?:passed|error|failed|xfailed).* in [\d\.]+ seconds')
+#: Manifest of dependency inputs that an env was developed with. It is stored in the env dir.
+ENV_MANIFEST_FILE = '.wst-dependencies.json'
+
+#: Files with dependency inputs (in addition to bump.requirement_files in workspace.cfg and tox.ini)
+DEPENDENCY_FILES = ['setup.py', 'setup.cfg', 'pyproject.toml']
+
+#: Test impact map of an env that maps tests to the files that they run. It is stored in the env dir.
+TEST_IMPACT_FILE = '.wst-test-impact.json'
+
+#: Tests selected from the test impact map for a run. It is stored in the env dir.
+TEST_IMPACT_SELECTION_FILE = '.wst-test-impact-selection.json'
+
+#: Files that may change how any test runs, so all tests are run (and the test impact map re-recorded) when they change
+TEST_IMPACT_GLOBAL_FILES = ['conftest.py', 'tox.ini', 'setup.cfg', 'pytest.ini', 'pyproject.toml']
+
+#: Dir with pytest plugins that are loaded in the test envs
+PYTEST_PLUGINS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pytest_plugins')
+
+TEST_RE = re.compile('\d+ (?:passed|error|failed|xfailed).* in [\d\.]+(?:s\\b| seconds)')
 BUILD_RE = re.compile('BUILD SUCCESSFUL')
+COUNT_RE = re.compile('(\d+) (passed|failed|errors?|skipped|xfailed|xpassed|deselected|warnings?)')
+DURATION_RE = re.compile(' in ([\d\.]+)(?:s\\b| seconds)')
+FAILED_TEST_RE = re.compile('^(?:(?:FAILED|ERROR) (\S+)|(\S+::\S+) (?:FAILED|ERROR))')
+
+#: JUnit XML report written by pytest for each test run. It is stored in the env dir.
+REPORT_FILE = '.wst-report.xml'
+
+#: Order of outcomes in the summary composed from the report (same as pytest)
+OUTCOMES = ['failed', 'passed', 'skipped', 'deselected', 'xfailed', 'xpassed', 'error']
+
+#: Number of slowest tests to keep from the report
+SLOWEST_TESTS = 20
+
+#: Number of lines at the end of test output to keep in memory
+TAIL_LINES = 50
+
+#: Bytes of test output to keep in memory before writing it to the output file
+SPILL_BYTES = 1024 * 1024
+
+
+class TestOutput(object):
+    """
+    Summary of test output that is parsed line by line as tests run, so the full output is not kept as one string.
+
+    When pytest writes a JUnit XML report, test results (and the slowest tests) are read from it instead.
+
+    Only the last :data:`TAIL_LINES` lines are kept after the tests complete. The full output is written to
+    output_file when the tests fail (or as it comes in once it is larger than :data:`SPILL_BYTES`, which is
+    removed if the tests pass).
+    """
+    __test__ = False
+
+    def __init__(self, output_file=None, tail_lines=TAIL_LINES):
+        """
+        :param str output_file: File to write the full output to when the tests fail. If not set, only the tail is kept.
+        :param int tail_lines: Number of lines at the end of the output to keep
+        """
+        #: Summary line of the test results (e.g. "2 passed in 0.12s"), or None if not found
+        self.summary = None
+        #: Map of outcome (passed, failed, error, skipped, etc) to number of tests from the summary line
+        self.counts = {}
+        #: Seconds that the tests took from the summary line, or None if not found
+        self.duration = None
+        #: Ids of the tests that failed or errored
+        self.failed_tests = []
+        #: True if the tests passed. Only available after :meth:`close`
+        self.success = None
+        #: File with the full output if the tests failed
+        self.output_file = None
+        #: Slowest tests from the report as a list of dict with test (id), duration, and outcome
+        self.slowest_tests = []
+
+        self._output_file = output_file
+        self._tail = deque(maxlen=tail_lines)
+        self._buffer = []
+        self._buffer_size = 0
+        self._spill_fp = None
+        self._partial = ''
+        self._build_successful = False
+        self._no_tests = False
+        self._has_error = False
+        self._separators = 0
+        self._last_separator = ''
+
+    @classmethod
+    def parse(cls, output):
+        """ Parse the full output of tests """
+        test_output = cls()
+        test_output.feed(output)
+        test_output.close()
+        return test_output
+
+    @property
+    def tail(self):
+        """ Last lines of the output """
+        return '\n'.join(self._tail)
+
+    @property
+    def no_tests(self):
+        """ True if no tests were collected """
+        return self._no_tests and not self._has_error
+
+    def __contains__(self, text):
+        return text in self.tail
+
+    def __str__(self):
+        return self.tail
+
+    def feed(self, output):
+        """ Parse the next part of the output """
+        lines = (self._partial + output).split('\n')
+        self._partial = lines.pop()
+
+        for line in lines:
+            self._parse_line(line)
+
+    def _parse_line(self, line):
+        self._tail.append(line)
+        self._store(line + '\n')
+
+        if 'collected 0 items' in line:
+            self._no_tests = True
+        if 'error' in line:
+            self._has_error = True
+
+        if self.summary is None:
+            match = TEST_RE.search(line)
+            if match:
+                self.summary = match.group(0)
+            elif BUILD_RE.search(line):
+                self._build_successful = True
+
+        if line.startswith('===') and 'warnings summary' not in line:
+            self._separators += 1
+            self._last_separator = line
+
+        match = FAILED_TEST_RE.match(line)
+        if match:
+            test_id = match.group(1) or match.group(2)
+            if test_id not in self.failed_tests:
+                self.failed_tests.append(test_id)
+
+    def _store(self, text):
+        if not self._output_file:
+            return
+
+        if self._spill_fp:
+            self._spill_fp.write(text)
+            return
+
+        self._buffer.append(text)
+        self._buffer_size += len(text)
+
+        if self._buffer_size > SPILL_BYTES:
+            self._spill()
+
+    def _spill(self):
+        self._spill_fp = open(self._output_file, 'w')
+        self._spill_fp.write(''.join(self._buffer))
+        self._buffer = []
+
+    @staticmethod
+    def _test_id(case):
+        """
+        Pytest node id of the test case in the report, e.g. tests/test_a.py::TestA::test_x for classname
+        tests.test_a.TestA and name test_x. The test file is from the file attribute (written with junit_family=xunit1),
+        or else the module is assumed to end before the first CapWords (class) part of the classname.
+        """
+        parts = (case.get('classname') or '').split('.')
+        test_file = case.get('file')
+
+        if test_file:
+            module_parts = len(os.path.splitext(test_file)[0].split(os.sep))
+        else:
+            module_parts = next((i for i, part in enumerate(parts) if part[:1].isupper()), len(parts))
+            test_file = os.path.join(*parts[:module_parts]) + '.py' if module_parts else None
+
+        return '::'.join(filter(None, [test_file] + parts[module_parts:] + [case.get('name')]))
+
+    def _read_report(self, report_file):
+        """
+        Read test results from the JUnit XML report of pytest
+
+        :return: True if the report was read
+        """
+        try:
+            root = ElementTree.parse(report_file).getroot()
+        except Exception as e:
+            log.debug('Could not read test report %s: %s', report_file, e)
+            return False
+
+        counts = {}
+        duration = 0
+        failed_tests = []
+        tests = []
+
+        for suite in [root] if root.tag == 'testsuite' else root.iter('testsuite'):
+            duration += float(suite.get('time') or 0)
+
+            for case in suite.iter('testcase'):
+                test_id = self._test_id(case)
+                tags = dict((child.tag, child) for child in case)
+
+                if 'failure' in tags:
+                    outcome = 'failed'
+                elif 'error' in tags:
+                    outcome = 'error'
+                elif 'skipped' in tags:
+                    outcome = 'xfailed' if tags['skipped'].get('type') == 'pytest.xfail' else 'skipped'
+                else:
+                    outcome = 'passed'
+
+                counts[outcome] = counts.get(outcome, 0) + 1
+                if outcome in ('failed', 'error'):
+                    failed_tests.append(test_id)
+                tests.append((float(case.get('time') or 0), test_id, outcome))
+
+        self.counts = counts
+        self.duration = round(duration, 2)
+        self.failed_tests = failed_tests
+        self.slowest_tests = [{'test': t, 'duration': d, 'outcome': o}
+                              for d, t, o in sorted(tests, key=lambda t: -t[0])[:SLOWEST_TESTS]]
+        self.summary = '{} in {:.2f}s'.format(
+            ', '.join('{} {}'.format(counts[o], o) for o in OUTCOMES if counts.get(o)) or 'no tests ran', duration)
+        self._no_tests = not tests
+
+        return True
+
+    def close(self, exit_code=None, report_file=None):
+        """
+        Complete parsing the output and decide if the tests passed
+
+        :param int exit_code: Exit code of the test command. Tests fail if it is not 0 (unless no tests were found).
+        :param str report_file: JUnit XML report of pytest to get test results from instead of the summary in the output.
+                                Results from the output are used if it does not exist.
+        """
+        if self._partial:
+            self._parse_line(self._partial)
+            self._partial = ''
+
+        if report_file and os.path.exists(report_file) and self._read_report(report_file):
+            self.success = not self.failed_tests and (exit_code in (None, 0) or self.no_tests)
+
+        else:
+            if self.summary is None and self._build_successful:
+                self.summary = BUILD_RE.pattern
+
+            summary_line = self._last_separator if self._separators else ''
+            for count, outcome in COUNT_RE.findall(summary_line):
+                self.counts[outcome.rstrip('s') if outcome in ('errors', 'warnings') else outcome] = int(count)
+
+            match = DURATION_RE.search(self.summary or '')
+            if match:
+                self.duration = float(match.group(1))
+
+            outcomes = summary_line.replace('xfailed', '')
+            self.success = (self._separators == 2 and 'failed' not in outcomes and 'error' not in outcomes and
+                            (exit_code in (None, 0) or self.no_tests))
+
+        if not self.success and self._output_file and not self._spill_fp:
+            self._spill()
+
+        if self._spill_fp:
+            self._spill_fp.close()
+            if self.success:
+                os.unlink(self._spill_fp.name)
+            else:
+                self.output_file = self._spill_fp.name
+            self._spill_fp = None
+
+        self._buffer = []
+        return self
 
 
 class Test(AbstractCommand):
@@ -38,10 +315,21 @@ class Test(AbstractCommand):
       :param bool show_dependencies: Show where product dependencies are installed from and their versions.
       :param bool test_dependents: Run tests in this product and in checked out products that depends on this product.
                                    This product must be installed as editable in its dependents for the results to be useful.
+                                   Products are tested in waves based on dependency order (this product first), and
+                                   up to [parallel] workers products are tested at the same time.
                                    Most args are ignored when this is used.
+      :param bool fail_fast: When testing dependents, skip testing products that depend on a product that failed.
+      :param str format: Output format of the test summary of each product when testing dependents. With json or
+                         ndjson, a record with product, success, summary, skipped, output_file (output of
+                         failed tests), counts (of tests per outcome), duration, failed_tests (ids), and slowest_tests
+                         (up to --slowest or 5 of test, duration, and outcome) is written for each product as soon as
+                         its tests complete. Only text is supported without --test-dependents.
+      :param int slowest: Show the given number of slowest tests (per product when testing dependents).
+                          Test results are read from the JUnit XML report that pytest writes to the test env.
       :param bool redevelop: Redevelop the test environment by installing on top of existing one.
-                             This is implied if test environment does not exist, or whenever requirements.txt or
-                             pinned.txt is modified after the environment was last updated.
+                             This is implied if test environment does not exist, or whenever the content of
+                             requirements.txt, pinned.txt, tox.ini, or setup.py has changed since the environment
+                             was last updated.
                              Use -ro to do redevelop only without running tests.
                              Use -rr to remove the test environment first before redevelop (recreate).
       :param bool install_only: Modifier for redevelop. Perform install only without running test.
@@ -58,8 +346,8 @@ class Test(AbstractCommand):
       :param bool debug: Turn on debug logging
       :param list install_editable: List of products or product groups to install in editable mode.
       :param list extra_args: Extra args from argparse to be passed to pytest
-      :return: Dict of env to commands ran on success. If return_output is True, return a string output.
-               If test_dependents is True, return a mapping of product name to the mentioned results.
+      :return: Dict of env to commands ran on success. If return_output is True, return a :class:`TestOutput` of the
+               test output. If test_dependents is True, return a mapping of product name to the mentioned results.
     """
 
     def __init__(self, *args, **kwargs):
@@ -77,6 +365,9 @@ class Test(AbstractCommand):
           cls.make_args('-d', '--show-dependencies', metavar='FILTER', action='store', nargs='?', help=docs['show_dependencies'],
                         const=True),
           cls.make_args('-t', '--test-dependents', action='store_true', help=docs['test_dependents']),
+          cls.make_args('--fail-fast', action='store_true', help=docs['fail_fast']),
+          cls.make_args('--format', choices=OUTPUT_FORMATS, default='text', help=docs['format']),
+          cls.make_args('--slowest', metavar='COUNT', type=int, help=docs['slowest']),
           cls.make_args('-r', '--redevelop', action='count', help=docs['redevelop']),
           cls.make_args('-o', action='store_true', dest='install_only', help=argparse.SUPPRESS),
           cls.make_args('-e', '--install-editable', nargs='+', help=docs['install_editable']),
@@ -87,7 +378,7 @@ class Test(AbstractCommand):
         try:
             if not repo:
                 repo = project_path()
-            tox = ToxIni(repo)
+            tox = ToxIni.for_path(repo)
             return 'testenv:style' in tox
 
         except Exception as e:
@@ -100,7 +391,8 @@ class Test(AbstractCommand):
         """
           Summarize the test results
 
-          :param dict|str tests: Map of product name to test result, or the test result of the current prod.
+          :param dict|str|TestOutput tests: Map of product name to test result, or the test result of the current prod.
+                                            A test result is test output, :class:`TestOutput`, or bool.
           :param bool include_no_tests: Include "No tests" results when there are no tests found.
           :return: A tuple of (success, list(summaries)) where success is True if all tests pass and summaries
                    is a list of passed/failed summary of each test or just str if 'tests' param is str.
@@ -123,35 +415,35 @@ class Test(AbstractCommand):
                 summaries.append("%s: %s" % (name, summary))
 
         for name in sorted(product_tests, key=lambda n: n == prod_name or n):
-            if not product_tests[name]:
+            result = product_tests[name]
+
+            if not result:
                 success = False
                 append_summary('Test failed / No output', name)
 
-            elif product_tests[name] is True:
+            elif result is True:
                 append_summary('Test successful / No output', name)
 
-            elif 'collected 0 items' in product_tests[name] and 'error' not in product_tests[name]:
-                append_summary('No tests')
-
             else:
-                match = TEST_RE.search(product_tests[name])
+                if not isinstance(result, TestOutput):
+                    result = TestOutput.parse(result)
 
-                if not match:  # Fall back to build if there are no tests.
-                    match = BUILD_RE.search(product_tests[name])
+                if result.no_tests:
+                    append_summary('No tests')
 
-                if match:
-                    append_summary(match.group(0), name)
                 else:
-                    append_summary('No test summary found in output', name)
+                    append_summary(result.summary or 'No test summary found in output', name)
 
-                summary_lines = [l for l in product_tests[name].replace('xfailed', '').split('\n')
-                                 if l.startswith('===') and 'warnings summary' not in l]
-                if not len(summary_lines) == 2 or 'failed' in summary_lines[-1] or 'error' in summary_lines[-1]:
-                    success = False
+                    if not result.success:
+                        success = False
 
         return success, summaries if isinstance(tests, dict) else summaries[0]
 
     def run(self):
+        if self.format and self.format != 'text' and not self.test_dependents:
+            log.error('--format %s is only supported with -t / --test-dependents', self.format)
+            sys.exit(1)
+
         if self.test_dependents:
             name = product_name()
 
@@ -170,28 +462,43 @@ class Test(AbstractCommand):
               ('extra_args', tuple(self.extra_args))
             )
 
-            test_repos = [repo_path()]
-            test_repos.extend(r for r in repos(workspace_path()) if self.product_depends_on(r, name) and r not in test_repos)
-            test_args = [(r, test_args, self.__class__) for r in test_repos]
+            graph = DependencyGraph.for_workspace(workspace_path())
+            product_paths = dict(graph.products)
+            product_paths[name] = repo_path()
+            waves = [[name]] + graph.waves(graph.dependents(name))
+            workers = default_workers(sum(len(w) for w in waves))
+            writer = RecordWriter(self.format) if self.format and self.format != 'text' else None
 
             def test_done(result):
                 name, output = result
                 success, summary = self.summarize(output)
+                temp_output_file = getattr(output, 'output_file', None)
+
+                if not success and not temp_output_file:
+                    temp_output_file = os.path.join(tempfile.gettempdir(), 'test-%s.out' % name)
+                    with open(temp_output_file, 'w') as fp:
+                        fp.write(output or '')
+
+                if writer:
+                    writer.write({'product': name, 'success': success, 'summary': summary, 'skipped': False,
+                                  'output_file': temp_output_file, 'counts': getattr(output, 'counts', {}),
+                                  'duration': getattr(output, 'duration', None),
+                                  'failed_tests': getattr(output, 'failed_tests', []),
+                                  'slowest_tests': getattr(output, 'slowest_tests', [])[:self.slowest or 5]})
+                    return
 
                 if success:
                     click.echo('{}: {}'.format(name, summary))
 
                 else:
-                    temp_output_file = os.path.join(tempfile.gettempdir(), 'test-%s.out' % name)
-                    with open(temp_output_file, 'w') as fp:
-                        fp.write(output)
-                    temp_output_file = 'See ' + temp_output_file
+                    log.error('%s: %s', name, '\n\t'.join([summary, 'See ' + temp_output_file]))
 
-                    log.error('%s: %s', name, '\n\t'.join([summary, temp_output_file]))
+                if self.slowest and isinstance(output, TestOutput):
+                    self.show_slowest_tests(output, name)
 
             def show_remaining(completed, all_args):
-                completed_repos = set(product_name(r) for r, _, _ in completed)
-                all_repos = set(product_name(r) for r, _, _ in all_args)
+                completed_repos = set(product_name(args[0]) for args in completed)
+                all_repos = set(product_name(args[0]) for args in all_args)
                 remaining_repos = sorted(list(all_repos - completed_repos))
                 if len(remaining_repos):
                     repo = remaining_repos.pop()
@@ -200,25 +507,54 @@ class Test(AbstractCommand):
                 else:
                     return 'None'
 
-            repo_results = parallel_call(test_repo, test_args, callback=test_done, show_progress=show_remaining, progress_title='Remaining')
+            repo_results = {}
+            failed = set()
+
+            for wave in waves:
+                if self.fail_fast:
+                    skipped = [n for n in wave if graph.dependencies.get(n, set()) & failed]
+                    for skipped_name in skipped:
+                        summary = 'Skipped as its dependencies failed: {}'.format(
+                            ', '.join(sorted(graph.dependencies[skipped_name] & failed)))
+                        if writer:
+                            writer.write({'product': skipped_name, 'success': False, 'summary': summary,
+                                          'skipped': True, 'output_file': None, 'counts': {}, 'duration': None,
+                                          'failed_tests': [], 'slowest_tests': []})
+                        else:
+                            click.echo('{}: {}'.format(skipped_name, summary))
+                    failed.update(skipped)
+                    wave = [n for n in wave if n not in skipped]
 
-            for result in list(repo_results.values()):
-                if isinstance(result, tuple):
-                    _, result = result
-                success, _ = self.summarize(result)
-                if not (success or self.return_output):
-                    sys.exit(1)
+                wave_args = [(product_paths[n], test_args, self.__class__, bool(writer)) for n in wave]
+                results = parallel_call(test_repo, wave_args, callback=test_done, workers=workers,
+                                        show_progress=not writer and show_remaining, progress_title='Remaining')
+
+                for (repo, _, _, _), result in results.items():
+                    test_name, output = result if isinstance(result, tuple) else (product_name(repo), result)
+                    repo_results[test_name] = output
+                    if not self.summarize(output)[0]:
+                        failed.add(test_name)
 
-            return dict(list(repo_results.values()))
+            if writer:
+                writer.close()
+
+            if failed and not self.return_output:
+                sys.exit(1)
+
+            return repo_results
 
         if not self.repo:
             self.repo = project_path()
 
+        # Environment for the test commands of this repo. Products may be tested at the same time in threads, so
+        # os.environ is not changed.
+        self.env_vars = dict(os.environ)
+
         # Strip out venv bin path to python to avoid issues with it being removed when running tox
-        if 'VIRTUAL_ENV' in os.environ:
-            venv_bin = os.environ['VIRTUAL_ENV']
-            os.environ['PATH'] = os.pathsep.join([p for p in os.environ['PATH'].split(os.pathsep)
-                                                  if os.path.exists(p) and not p.startswith(venv_bin)])
+        if 'VIRTUAL_ENV' in self.env_vars:
+            venv_bin = self.env_vars['VIRTUAL_ENV']
+            self.env_vars['PATH'] = os.pathsep.join([p for p in self.env_vars['PATH'].split(os.pathsep)
+                                                     if os.path.exists(p) and not p.startswith(venv_bin)])
 
         envs = []
         files = []
@@ -244,9 +580,9 @@ class Test(AbstractCommand):
             if files:
                 pytest_args.extend(files)
             pytest_args = ' '.join(pytest_args)
-            os.environ['PYTESTARGS'] = pytest_args
+            self.env_vars['PYTESTARGS'] = pytest_args
 
-        tox = ToxIni(self.repo, self.tox_ini)
+        tox = ToxIni.for_path(self.repo, self.tox_ini)
 
         if not envs:
             envs = tox.envlist
@@ -256,7 +592,7 @@ class Test(AbstractCommand):
             # isn't interesting yet.
             if pytest_args:
                 if 'cover' in envs:
-                    python = tox.get(tox.envsection('cover'), 'basepython')
+                    python = tox.env('cover')['basepython']
                     version = ''.join(python.strip('python').split('.')) if python else '36'
                     envs[envs.index('cover')] = 'py' + version
                 if 'style' in envs:
@@ -296,7 +632,8 @@ class Test(AbstractCommand):
             if self.install_only:
                 cmd.append('--notest')
 
-            output = run(cmd, cwd=self.repo, raises=not self.return_output, silent=self.silent, return_output=self.return_output)
+            output = run(cmd, cwd=self.repo, raises=not self.return_output, silent=self.silent, return_output=self.return_output,
+                         env=self.env_vars)
 
             if not output:
                 if self.return_output:
@@ -307,10 +644,16 @@ class Test(AbstractCommand):
             for env in envs:
                 env_commands[env] = ' '.join(cmd)
 
-                # Touch envdir
+                # Touch envdir and record the dependency inputs it was developed with
                 envdir = tox.envdir(env)
                 if os.path.exists(envdir):
                     os.utime(envdir, None)
+                    self._save_dependency_manifest(tox, env)
+
+                    # Dependencies may have changed what tests run
+                    impact_file = os.path.join(envdir, TEST_IMPACT_FILE)
+                    if os.path.exists(impact_file):
+                        os.unlink(impact_file)
 
                 # Strip entry version
                 self._strip_version_from_entry_scripts(tox, env)
@@ -319,19 +662,13 @@ class Test(AbstractCommand):
                 return output
 
         else:
+            parallel_envs = []
+            env_pytest_args = {}
+
             for env in envs:
                 envdir = tox.envdir(env)
 
-                def requirements_updated():
-                    req_mtime = 0
-                    requirements_files = ['requirements.txt', 'pinned.txt', 'tox.ini']
-                    for req_file in requirements_files:
-                        req_path = os.path.join(self.repo, req_file)
-                        if os.path.exists(req_path):
-                            req_mtime = max(req_mtime, os.stat(req_path).st_mtime)
-                    return req_mtime > os.stat(envdir).st_mtime
-
-                if not os.path.exists(envdir) or requirements_updated():
+                if not os.path.exists(envdir) or self.requirements_updated(tox, env):
                     env_commands.update(
                         self.commander.run('test', env_or_file=[env], repo=self.repo, redevelop=True, tox_cmd=self.tox_cmd,
                                            tox_ini=self.tox_ini, tox_commands=self.tox_commands, match_test=self.match_test,
@@ -341,20 +678,46 @@ class Test(AbstractCommand):
 
                 commands = self.tox_commands.get(env) or tox.commands(env)
                 env_commands[env] = '\n'.join(commands)
+                env_pytest_args[env] = pytest_args
+
+                if (not files and not self.match_test and self.uses_test_impact() and
+                        any(self._is_pytest(command) for command in commands)):
+                    impact_args = self._test_impact_args(tox, env)
+
+                    if impact_args is None:
+                        if not self.silent:
+                            click.echo('{}: No tests affected by changes'.format(env))
+                        if self.return_output:
+                            return True
+                        continue
+
+                    env_pytest_args[env] = ' '.join(filter(None, [pytest_args, impact_args]))
+
+                if len(envs) > 1 and not self.return_output and self.runs_envs_in_parallel():
+                    parallel_envs.append(env)
+                    continue
 
                 for command in commands:
-                    full_command = os.path.join(envdir, 'bin', command)
+                    full_command = self._full_command(envdir, command, env_pytest_args[env])
+                    full_command, report_file = self._with_report_file(envdir, full_command)
 
                     command_path = full_command.split()[0]
                     if os.path.exists(command_path):
-                        if 'pytest' in full_command or 'py.test' in full_command:
-                            if 'PYTESTARGS' in full_command:
-                                full_command = full_command.replace('{env:PYTESTARGS:}', pytest_args)
+                        output = None
+                        if self.uses_warm_runner() and self._is_pytest(full_command):
+                            output = self._run_with_warm_runner(tox, env, full_command, report_file)
+
+                        if output is None:
+                            activate = '. ' + os.path.join(envdir, 'bin', 'activate')
+                            if self.return_output:
+                                output = self._run_and_parse(activate + '; ' + full_command, report_file)
                             else:
-                                full_command += ' ' + pytest_args
-                        activate = '. ' + os.path.join(envdir, 'bin', 'activate')
-                        output = run(activate + '; ' + full_command, shell=True, cwd=self.repo, raises=False, silent=self.silent,
-                                     return_output=self.return_output)
+                                output = run(activate + '; ' + full_command, shell=True, cwd=self.repo, raises=False,
+                                             silent=self.silent, env=self.env_vars)
+
+                        if self.slowest and report_file and not self.return_output:
+                            self.show_slowest_tests(TestOutput().close(report_file=report_file))
+
                         if not output:
                             if self.return_output:
                                 return False
@@ -373,8 +736,379 @@ class Test(AbstractCommand):
                         else:
                             sys.exit(1)
 
+            if parallel_envs and not self._run_envs_in_parallel(tox, parallel_envs, env_pytest_args):
+                sys.exit(1)
+
         return env_commands
 
+    def _selected_by(self, products):
+        """ True if the repo is one of the products / product groups (or * for all) """
+        products = (products or '').split()
+        return '*' in products or product_name(self.repo) in expand_product_groups(products)
+
+    def runs_envs_in_parallel(self):
+        """ True if envs of the repo should run in parallel based on test.parallel_envs in workspace.cfg """
+        return self._selected_by(config.test.parallel_envs)
+
+    def uses_warm_runner(self):
+        """ True if pytest should be run with a warm runner for the repo based on test.warm_runner in workspace.cfg """
+        return self._selected_by(config.test.warm_runner)
+
+    def uses_test_impact(self):
+        """ True if only tests affected by changes should run for the repo based on test.impact_analysis in workspace.cfg """
+        return self._selected_by(config.test.impact_analysis)
+
+    @staticmethod
+    def _is_pytest(command):
+        return 'pytest' in command or 'py.test' in command
+
+    def _full_command(self, envdir, command, pytest_args):
+        """ Full path to command in envdir with pytest args added if it is a pytest command """
+        full_command = os.path.join(envdir, 'bin', command)
+
+        if self._is_pytest(full_command):
+            if 'PYTESTARGS' in full_command:
+                full_command = full_command.replace('{env:PYTESTARGS:}', pytest_args)
+            else:
+                full_command += ' ' + pytest_args
+
+        return full_command
+
+    def affected_tests(self, impact_file):
+        """
+        Tests affected by changes in the repo based on the test impact map of an env. Changes are the files that differ
+        from the parent branch or from the commit that the map was recorded at (including uncommitted ones).
+
+        :param str impact_file: Path to the test impact map
+        :return: Dict with tests (ids of tests that ran a changed file or failed last time) and files (changed test
+                 files to run all tests in), or None if the map is missing / stale and all tests should run.
+                 The map is stale when a file that affects all tests (such as conftest.py or requirements.txt) has
+                 changed, when a changed file is not in the map (e.g. data files or new modules, which may affect
+                 any test), or when more than half of the tests are affected anyway.
+        """
+        try:
+            with open(impact_file) as fp:
+                impact_map = json.load(fp)
+        except Exception as e:
+            log.debug('Test impact map is not available: %s', e)
+            return None
+
+        if not silent_run(['git', 'cat-file', '-e', impact_map['commit'] + '^{commit}'], cwd=self.repo, raises=False):
+            log.debug('Test impact map is stale as its commit %s does not exist', impact_map['commit'])
+            return None
+
+        branch = current_branch(self.repo)
+        bases = [impact_map['commit']]
+        parent = branch and parent_branch(branch) or master_branch(self.repo)
+        if parent in all_branches(self.repo):
+            bases.append(parent)
+
+        # Paths from git are relative to the top level of the git repo, while the map is relative to the repo
+        git_root = silent_run(['git', 'rev-parse', '--show-toplevel'], cwd=self.repo, return_output=True).strip()
+        git_paths = set()
+
+        for base in bases:
+            git_paths.update(diff_repo(self.repo, branch=base, name_only=True, return_output=True).splitlines())
+
+        for change in repo_status(self.repo)['changes']:
+            if change['status'] == '??':
+                path = change['path']
+                if path.endswith('/'):  # Untracked dir
+                    git_paths.update(os.path.relpath(os.path.join(root, f), git_root)
+                                     for root, _, dir_files in os.walk(os.path.join(git_root, path)) for f in dir_files)
+                else:
+                    git_paths.add(path)
+
+        changed = set(os.path.relpath(os.path.join(git_root, p), self.repo) for p in git_paths)
+
+        def is_test_file(path):
+            return path.endswith('.py') and (os.path.basename(path).startswith('test_') or path.endswith('_test.py'))
+
+        global_files = [os.path.relpath(f, self.repo) for f in self.dependency_files(ToxIni.for_path(self.repo, self.tox_ini))]
+        mapped_files = set(impact_map['files'])
+
+        for path in changed:
+            if path in global_files or os.path.basename(path) in TEST_IMPACT_GLOBAL_FILES:
+                log.debug('Test impact map is stale as %s has changed', path)
+                return None
+
+            if path not in mapped_files and not is_test_file(path):
+                log.debug('Test impact map is stale as %s has changed and it is not in the map', path)
+                return None
+
+        changed_files = set(i for i, f in enumerate(impact_map['files']) if f in changed)
+        tests = set(t for t, files in impact_map['tests'].items() if changed_files.intersection(files))
+        tests.update(impact_map.get('failed', []))
+
+        if len(tests) > len(impact_map['tests']) / 2:
+            log.debug('Test impact map is stale as most tests (%s of %s) are affected', len(tests), len(impact_map['tests']))
+            return None
+
+        test_files = [f for f in changed if is_test_file(f) and os.path.exists(os.path.join(self.repo, f))]
+
+        return {'tests': sorted(tests), 'files': sorted(test_files)}
+
+    def _test_impact_args(self, tox, env):
+        """
+        Pytest args to only run tests affected by changes (see :meth:`affected_tests`), or to run all tests and record
+        the test impact map of the env when it is missing / stale.
+
+        :return: Pytest args, or None if no tests are affected by the changes
+        """
+        envdir = tox.envdir(env)
+        impact_file = os.path.join(envdir, TEST_IMPACT_FILE)
+        args = ['-p', 'wst_test_impact', '--wst-impact-map', impact_file]
+        selection = self.affected_tests(impact_file)
+
+        if selection is None:
+            commit, has_commit = silent_run(['git', 'rev-parse', '--verify', '-q', 'HEAD'], cwd=self.repo,
+                                            return_output=2)
+            if not has_commit:
+                return ''
+            args.extend(['--wst-impact-commit', commit.strip()])
+
+        elif not selection['tests'] and not selection['files']:
+            return None
+
+        else:
+            selection_file = os.path.join(envdir, TEST_IMPACT_SELECTION_FILE)
+            with open(selection_file, 'w') as fp:
+                json.dump(selection, fp)
+            args.extend(['--wst-impact-select', selection_file])
+
+        python_paths = self.env_vars.get('PYTHONPATH', '').split(os.pathsep)
+        if PYTEST_PLUGINS_DIR not in python_paths:
+            self.env_vars['PYTHONPATH'] = os.pathsep.join(filter(None, [PYTEST_PLUGINS_DIR] + python_paths))
+
+        return ' '.join(args)
+
+    def _with_report_file(self, envdir, full_command):
+        """
+        Add option to write a JUnit XML report to the pytest command when test results are needed (return_output or
+        --slowest), unless it writes one already
+
+        :return: Tuple of full command and path to the report file (None if no report is written by the option)
+        """
+        if (not (self.return_output or self.slowest) or not self._is_pytest(full_command)
+                or '--junitxml' in full_command or '--junit-xml' in full_command):
+            return full_command, None
+
+        report_file = os.path.join(envdir, REPORT_FILE)
+        if os.path.exists(report_file):
+            os.unlink(report_file)
+
+        # xunit1 adds the file of each test, so test ids in the report can be converted to pytest node ids
+        return full_command + ' -o junit_family=xunit1 --junitxml=' + report_file, report_file
+
+    def show_slowest_tests(self, test_output, name=None):
+        """ Show the slowest tests (up to the number set by --slowest) of the test output from the report """
+        slowest_tests = test_output.slowest_tests[:self.slowest]
+        if not slowest_tests:
+            return
+
+        click.echo('Slowest tests{}:'.format(' in ' + name if name else ''))
+        for test in slowest_tests:
+            outcome = '' if test['outcome'] == 'passed' else ' (' + test['outcome'] + ')'
+            click.echo('  {:>8.2f}s  {}{}'.format(test['duration'], test['test'], outcome))
+
+    def _run_with_warm_runner(self, tox, env, full_command, report_file=None):
+        """
+        Run the pytest command in a worker forked from the warm runner of the env, which has pytest and the
+        dependencies of the product imported already. The runner is started on first use, and restarted
+        when any of the dependency inputs (see :meth:`dependency_files`) changes.
+
+        :return: Same as :func:`run` for the command, or None if the warm runner is not available or the command is
+                 not a plain pytest command (e.g. `python -m pytest` or `coverage run -m pytest`).
+        """
+        from workspace.warm_runner import WarmRunner, WarmRunnerError
+
+        args = shlex.split(full_command)
+        if os.path.basename(args[0]) not in ('pytest', 'py.test'):
+            log.debug('Running without warm runner as it only supports pytest commands: %s', full_command)
+            return None
+
+        preload = sorted(name.replace('-', '_') for name in requirement_names(self.repo))
+        test_output = self._test_output()
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+        def output(chunk):
+            if self.return_output:
+                test_output.feed(decoder.decode(chunk))
+            if not self.silent:
+                sys.stdout.flush()
+                getattr(sys.stdout, 'buffer', sys.stdout).write(chunk)
+                sys.stdout.flush()
+
+        try:
+            runner = WarmRunner(tox.bindir(env, 'python'), watch_files=self.dependency_files(tox), preload=preload)
+
+            # Same env as activating the test env for the command
+            bindir = os.path.dirname(runner.python)
+            env_vars = dict(self.env_vars, VIRTUAL_ENV=os.path.dirname(bindir),
+                            PATH=os.pathsep.join([bindir, self.env_vars.get('PATH', '')]))
+            env_vars.pop('PYTHONHOME', None)
+            exit_code = runner.run(args[1:], cwd=self.repo, env=env_vars, output=output)
+
+        except (WarmRunnerError, OSError) as e:
+            log.debug('Running without warm runner as it is not available: %s', e)
+            return None
+
+        if self.return_output:
+            test_output.feed(decoder.decode(b'', True))
+            return test_output.close(exit_code, report_file)
+
+        return exit_code == 0
+
+    def _test_output(self):
+        """ :class:`TestOutput` for the repo with output file in the temp dir """
+        return TestOutput(os.path.join(tempfile.gettempdir(), 'test-%s.out' % product_name(self.repo)))
+
+    def _run_and_parse(self, command, report_file=None):
+        """
+        Run the shell command with its output parsed as it runs (and shown unless silent)
+
+        :param str report_file: JUnit XML report written by the command to get test results from
+        :return: :class:`TestOutput` of the command
+        """
+        test_output = self._test_output()
+        process = subprocess.Popen(command, shell=True, cwd=self.repo, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   env=self.env_vars)
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+        for line in iter(process.stdout.readline, b''):
+            line = decoder.decode(line)
+            if not self.silent:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+            test_output.feed(line)
+
+        process.stdout.close()
+        test_output.feed(decoder.decode(b'', True))
+        return test_output.close(process.wait(), report_file)
+
+    def _run_envs_in_parallel(self, tox, envs, env_pytest_args):
+        """
+        Run commands for envs in parallel with output captured per env. Output of each env is shown in its own
+        section (in envlist order) as soon as it completes, followed by a summary of all envs.
+
+        :param dict env_pytest_args: Map of env to pytest args for its pytest commands
+        :return: True if commands for all envs passed
+        """
+        def run_env(env):
+            envdir = tox.envdir(env)
+            full_commands = ['. ' + os.path.join(envdir, 'bin', 'activate')]
+
+            for command in self.tox_commands.get(env) or tox.commands(env):
+                full_command = self._full_command(envdir, command, env_pytest_args[env])
+                command_path = full_command.split()[0]
+                if not os.path.exists(command_path):
+                    return '%s does not exist' % command_path, False
+                full_commands.append(full_command)
+
+            return run(' && '.join(full_commands), shell=True, cwd=self.repo, return_output=2, env=self.env_vars)
+
+        workers = config.test.parallel_envs_workers or len(envs)
+        results = []
+
+        if not self.silent:
+            click.echo('Running {} in parallel'.format(', '.join(envs)))
+
+        for env, (output, success) in zip(envs, parallel_map(run_env, envs, workers=workers)):
+            results.append((env, success))
+
+            if not (self.silent and success):
+                click.secho('[ {} ]'.format(env), bold=True)
+                click.echo(output.rstrip() + '\n')
+
+        for env, success in results:
+            if success:
+                if not self.silent:
+                    click.secho(f'{env}: OK', fg='green')
+            else:
+                click.secho(f'{env}: FAILED', fg='red')
+
+        return all(success for _, success in results)
+
+    def dependency_files(self, tox):
+        """ List of paths to files with dependency inputs for the test envs of the repo """
+        files = config.bump.requirement_files.split() + DEPENDENCY_FILES
+        return [os.path.join(self.repo, f) for f in files] + [tox.tox_ini]
+
+    def _dependency_manifest(self, tox, last_manifest=None):
+        """
+        Map of dependency file (relative to repo) to [mtime, size, sha1 of content] or None if it does not exist.
+        The version (e.g. version='1.2.3') is removed from the content of :data:`DEPENDENCY_FILES` before hashing, so
+        a version change from bump / publish does not require a redevelop.
+
+        :param dict last_manifest: Last manifest to reuse sha1 from for files with the same mtime and size
+        """
+        manifest = {}
+
+        for path in self.dependency_files(tox):
+            name = os.path.relpath(path, self.repo)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                manifest[name] = None
+                continue
+
+            last = (last_manifest or {}).get(name)
+            if last and last[:2] == [stat.st_mtime_ns, stat.st_size]:
+                manifest[name] = last
+            else:
+                with open(path, 'rb') as fp:
+                    content = fp.read()
+                if name in DEPENDENCY_FILES:
+                    content = VERSION_RE.sub('', content.decode('utf-8', 'replace')).encode('utf-8')
+                manifest[name] = [stat.st_mtime_ns, stat.st_size, hashlib.sha1(content).hexdigest()]
+
+        return manifest
+
+    def _save_dependency_manifest(self, tox, env, manifest=None):
+        manifest_file = os.path.join(tox.envdir(env), ENV_MANIFEST_FILE)
+
+        try:
+            with open(manifest_file, 'w') as fp:
+                json.dump(manifest or self._dependency_manifest(tox), fp)
+        except Exception as e:
+            log.debug('Could not save dependency manifest for %s: %s', env, e)
+
+    def requirements_updated(self, tox, env):
+        """
+        Check if the content of the dependency inputs has changed since the env was last developed.
+
+        Files are only hashed when their mtime or size has changed, so a touch or a branch switch with the
+        same content does not require a redevelop.
+        """
+        envdir = tox.envdir(env)
+
+        try:
+            with open(os.path.join(envdir, ENV_MANIFEST_FILE)) as fp:
+                last_manifest = json.load(fp)
+
+        except Exception:
+            # Env was developed without a manifest, so fall back to mtime to decide once.
+            dependency_mtimes = [os.stat(f).st_mtime for f in self.dependency_files(tox) if os.path.exists(f)]
+            if dependency_mtimes and max(dependency_mtimes) > os.stat(envdir).st_mtime:
+                return True
+
+            self._save_dependency_manifest(tox, env)
+            return False
+
+        manifest = self._dependency_manifest(tox, last_manifest)
+
+        def sha1(entry):
+            return entry and entry[2]
+
+        if any(sha1(manifest[f]) != sha1(last_manifest.get(f)) for f in manifest):
+            return True
+
+        if manifest != last_manifest:  # Record new mtimes to avoid hashing again
+            self._save_dependency_manifest(tox, env, manifest)
+
+        return False
+
     def _strip_version_from_entry_scripts(self, tox, env):
         """ Strip out version spec "==1.2.3" from entry scripts as they require re-develop when version is changed in develop mode. """
         name = product_name(tox.path)
@@ -520,25 +1254,13 @@ else:
                     lib_path = os.path.join(lib_path, lib)
                 run([pip, 'install', '--editable', lib_path], silent=not self.debug)
 
-    def product_depends_on(self, path, name):
-        for req_file in config.bump.requirement_files.split():
-            req_path = os.path.join(path, req_file)
-            if os.path.exists(req_path):
-                with open(req_path) as fp:
-                    try:
-                        reqs = pkg_resources.parse_requirements(fp.read())
-                        if name in [r.project_name for r in reqs]:
-                            return True
-                    except Exception:
-                        pass
-        return False
-
 
-def test_repo(repo, test_args, test_class):
+def test_repo(repo, test_args, test_class, quiet=False):
     name = product_name(repo)
 
-    branch = current_branch(repo)
-    on_branch = '#' + branch if branch != 'master' and branch is not None else ''
-    click.echo('Testing {} {}'.format(name, on_branch))
+    if not quiet:
+        branch = current_branch(repo)
+        on_branch = '#' + branch if branch != 'master' and branch is not None else ''
+        click.echo('Testing {} {}'.format(name, on_branch))
 
     return name, test_class(repo=repo, **dict(test_args)).run()
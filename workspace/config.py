@@ -13,6 +13,34 @@
   mzheng = workspace-tools clicast localconfig remoteconfig
 
 
+  ###########################################################################################################
+  # Settings for running against multiple products in parallel (such as wst update, status, or test -t)
+  ###########################################################################################################
+  [parallel]
+
+  # Executor to run with: thread, process, or auto. Auto uses threads as commands mostly wait on git / tox
+  # processes, which avoids forking and pickling overhead of a process pool.
+  executor = auto
+
+  # Number of products to work on at the same time. Defaults to 4 per CPU for threads or 1 per CPU for
+  # processes, and never more than the number of products.
+  workers =
+
+
+  ###########################################################################################################
+  # Settings for SSH connections made by git
+  ###########################################################################################################
+  [ssh]
+
+  # Share one SSH connection per git host for all git calls made during a command (using SSH's ControlMaster),
+  # so bulk commands (such as wst update on many products) only pay for the SSH handshake once per host.
+  # It is not used when GIT_SSH or GIT_SSH_COMMAND is set.
+  multiplex = true
+
+  # Seconds to keep a shared connection open after its last use.
+  control_persist = 60
+
+
   ###########################################################################################################
   # Settings for bump command
   ###########################################################################################################
@@ -31,9 +59,28 @@
   # It should accept a ?q=singleWord param
   search_api_url = https://api.github.com/search/repositories
 
+  # Days to cache the repo found by search_api_url for a product name
+  search_cache_days = 30
+
   # URL to use when checking out a user repo reference (e.g. wst checkout maxzheng/workspace-tools)
   user_repo_url = git@github.com:%s.git
 
+  # Clone strategy for new checkouts: full, blobless (file contents of past commits are fetched when needed),
+  # treeless (trees and file contents of past commits are fetched when needed), shallow (only the last
+  # clone_depth commits are cloned, and wst update / log fetch more history when needed), or single-branch.
+  clone_strategy = full
+
+  # Clone strategy for specific products or product groups, separated by space. e.g. monorepos=blobless
+  clone_strategies =
+
+  # Number of commits to clone for the shallow clone strategy
+  clone_depth = 50
+
+  # Keep a bare mirror of each product checked out with the full clone strategy in
+  # ~/.cache/workspace-tools/mirrors, and clone with objects from the mirror so checking out the same product
+  # again (e.g. after wst clean) only fetches new objects. The mirror is updated before each clone.
+  mirror_cache = false
+
   # User mapped to the origin remote. When set, checking out a repo that does not belong to the user
   # will use upstream remote. e.g. maxzheng
   origin_user =
@@ -69,20 +116,73 @@
 
   # Branches to merge separated by space (e.g. 3.2.x 3.3.x master)
   branches =
+
+
+  ###########################################################################################################
+  # Settings for test command
+  ###########################################################################################################
+  [test]
+
+  # Products or product groups to run tox envs in parallel for (such as style and unit test envs) when
+  # running all envs. Output of each env is shown after it completes. Use * for all products.
+  parallel_envs =
+
+  # Max number of envs to run at the same time. Defaults to number of envs.
+  parallel_envs_workers =
+
+  # Products or product groups to run pytest with a warm runner for, or * for all. The runner is a server per test
+  # env that has pytest and the dependencies imported, and each run forks from it, so running a few tests repeatedly
+  # (e.g. wst test tests/test_file.py) skips the startup / import overhead. It is restarted when requirements.txt,
+  # pinned.txt, tox.ini, or setup.py changes, and exits after an hour of idle time.
+  warm_runner =
+
+  # Products or product groups to only run tests affected by changes for, or * for all. When all tests of an env run
+  # (e.g. wst test or wst commit -t), the files that each test runs are recorded in a test impact map in the env dir.
+  # Later runs only run tests that ran a file changed from the parent branch (or since the map was recorded), new
+  # test files, and tests that failed last time. All tests run (and the map is recorded again) when conftest.py,
+  # tox.ini, or dependency files change, or when most tests are affected anyway.
+  impact_analysis =
 """
 from __future__ import absolute_import
 
 import logging
 import os
 
-from remoteconfig import RemoteConfig
+from localconfig import LocalConfig
 
 
 CONFIG_FILE = 'workspace.cfg'
 USER_CONFIG_FILE = os.path.join('~', '.config', CONFIG_FILE)
+CACHE_DIR = os.path.join('~', '.cache', 'workspace-tools')
 
 log = logging.getLogger()
-config = RemoteConfig(USER_CONFIG_FILE, cache_duration=60)
+
+
+class WorkspaceConfig(LocalConfig):
+    """
+    Same as :class:`remoteconfig.RemoteConfig`, but remoteconfig (and requests) is only imported when a URL source
+    is read, which keeps startup fast for commands that only need the local config.
+    """
+
+    def __init__(self, last_source=None, cache_duration=None, **localconfig_kwargs):
+        """
+          :param file/str last_source: Last config source, file or URL.
+          :param int cache_duration: For URL source only. Cache the URL content for the given duration (seconds).
+          :param dict localconfig_kwargs: Additional keyword args to be passed to :meth:`LocalConfig.__init__`
+        """
+        self._cache_duration = cache_duration
+
+        super(WorkspaceConfig, self).__init__(last_source, **localconfig_kwargs)
+
+    def _read(self, source):
+        if source.startswith('http://') or source.startswith('https://'):
+            from remoteconfig.utils import url_content
+            source = url_content(source, cache_duration=self._cache_duration, from_cache_on_error=True)
+
+        return super(WorkspaceConfig, self)._read(source)
+
+
+config = WorkspaceConfig(USER_CONFIG_FILE, cache_duration=60)
 config.read(__doc__.replace('\n  ', '\n'))
 
 
@@ -1,28 +1,44 @@
 from __future__ import absolute_import
 import argparse
+from importlib import import_module
 import logging
-import pkg_resources
 import sys
 import textwrap
 
-from workspace.commands.bump import Bump
-from workspace.commands.checkout import Checkout
-from workspace.commands.clean import Clean
-from workspace.commands.commit import Commit
-from workspace.commands.diff import Diff
-from workspace.commands.log import Log
-from workspace.commands.merge import Merge
-from workspace.commands.publish import Publish
-from workspace.commands.push import Push
-from workspace.commands.update import Update
-from workspace.commands.status import Status
-from workspace.commands.setup import Setup
-from workspace.commands.test import Test
-from workspace.utils import log_exception
+from workspace.config import config
+from workspace.scm import invalidate_repo_state, SSHMultiplexer
+from workspace.utils import invalidate_parent_paths, log_exception
 
 
 log = logging.getLogger(__name__)
 
+#: Map of command name to "module:Class" path of the command class. Commands are only imported when they are used,
+#: so a run only pays for importing the selected command and its dependencies.
+COMMANDS = {
+    'bump': 'workspace.commands.bump:Bump',
+    'checkout': 'workspace.commands.checkout:Checkout',
+    'clean': 'workspace.commands.clean:Clean',
+    'commit': 'workspace.commands.commit:Commit',
+    'diff': 'workspace.commands.diff:Diff',
+    'log': 'workspace.commands.log:Log',
+    'merge': 'workspace.commands.merge:Merge',
+    'publish': 'workspace.commands.publish:Publish',
+    'push': 'workspace.commands.push:Push',
+    'setup': 'workspace.commands.setup:Setup',
+    'status': 'workspace.commands.status:Status',
+    'test': 'workspace.commands.test:Test',
+    'update': 'workspace.commands.update:Update',
+}
+
+#: Map of command alias to command name, which allows an alias to be resolved without importing the commands.
+COMMAND_ALIASES = {
+    'ci': 'commit',
+    'co': 'checkout',
+    'di': 'diff',
+    'st': 'status',
+    'up': 'update',
+}
+
 
 class Commander(object):
     """
@@ -40,19 +56,65 @@ class Commander(object):
       * For more info, read the docs at http://workspace-tools.readthedocs.org
     """
 
+    _command_classes = {}
+
+    @classmethod
+    def command_paths(cls):
+        """
+          Map of command name to "module:Class" path of the command class that is imported on first use.
+          Override command_paths to replace any command name with another class to customize the command
+          without importing it upfront.
+        """
+        return COMMANDS
+
+    @classmethod
+    def command_aliases(cls):
+        """ Map of command alias to command name """
+        if cls._overrides_commands():
+            return dict((c.alias, c.name()) for c in cls.commands().values() if c.alias)
+        return COMMAND_ALIASES
+
     @classmethod
     def commands(cls):
         """
-          Map of command name to command classes.
+          Map of command name to command classes. This imports all commands, so use :meth:`command` to get one.
           Override commands to replace any command name with another class to customize the command.
         """
-        cs = [Bump, Checkout, Clean, Commit, Diff, Log, Merge, Publish, Push, Setup, Status, Test, Update]
-        return dict((c.name(), c) for c in cs)
+        return dict((name, cls.command(name)) for name in cls.command_paths())
+
+    @classmethod
+    def _overrides_commands(cls):
+        return cls.commands.__func__ is not Commander.commands.__func__
+
+    @classmethod
+    def command_names(cls):
+        """ Sorted list of command names """
+        return sorted(cls.commands() if cls._overrides_commands() else cls.command_paths())
+
+    @classmethod
+    def command_name(cls, name_or_alias):
+        """ Get command name for the given command name or alias, or None if there is no such command """
+        if name_or_alias in cls.command_names():
+            return name_or_alias
+        return cls.command_aliases().get(name_or_alias)
 
     @classmethod
     def command(cls, name):
-        """ Get command class for name """
-        return cls.commands().get(name)
+        """ Get command class for name or alias """
+        name = cls.command_name(name)
+
+        if not name:
+            return None
+
+        if cls._overrides_commands():
+            return cls.commands().get(name)
+
+        path = cls.command_paths()[name]
+        if path not in cls._command_classes:
+            module, command_class = path.split(':')
+            cls._command_classes[path] = getattr(import_module(module), command_class)
+
+        return cls._command_classes[path]
 
     @classmethod
     def main(cls):
@@ -64,7 +126,9 @@ class Commander(object):
           Sets up logging, parser, and creates the necessary command sequences to run, and runs
           the command given by the user.
         """
-        self.setup_parsers()
+        # Only setup the parser for the selected command as setting up all requires importing all commands
+        name = next((self.command_name(a) for a in sys.argv[1:] if not a.startswith('-')), None)
+        self.setup_parsers(names=[name] if name else None)
 
         args, extra_args = self.parser.parse_known_args()
 
@@ -72,7 +136,7 @@ class Commander(object):
             self.parser.print_help()
             sys.exit()
 
-        if args.command not in [c.name() for c in list(self.commands().values()) if 'extra_args' in c.docs()[1]] and extra_args:
+        if 'extra_args' not in self.command(args.command).docs()[1] and extra_args:
             log.error('Unrecognized arguments: %s', ' '.join(extra_args))
             sys.exit(1)
 
@@ -88,19 +152,33 @@ class Commander(object):
         """
           Run the command by name with given args.
 
-          :param str name: Name of command to run. If not given, this calls self._run()
+          :param str name: Name or alias of command to run. If not given, this calls self._run()
           :param kwargs: Args to pass to the command constructor
         """
         if not name:
             return self._run()
 
-        if name in self.commands():
+        command = self.command(name)
+
+        if command:
             kwargs['commander'] = self
-            return self.command(name)(**kwargs).run()
+            self._invalidate_caches()  # Repo may have been changed outside of workspace-tools
+            ssh_multiplexer = SSHMultiplexer()
+            if config.ssh.multiplex:
+                ssh_multiplexer.start()
+            try:
+                return command(**kwargs).run()
+            finally:
+                ssh_multiplexer.stop()
+                self._invalidate_caches()
         else:
-            log.error('Command "%s" is not registered. Override Commander.commands() to add.', name)
+            log.error('Command "%s" is not registered. Override Commander.command_paths() to add.', name)
             sys.exit(1)
 
+    def _invalidate_caches(self):
+        invalidate_repo_state()
+        invalidate_parent_paths()
+
     def _setup_parser(self):
         """
           Sets up the main parser.
@@ -111,19 +189,16 @@ class Commander(object):
                                               formatter_class=argparse.RawDescriptionHelpFormatter)
         self.parser.register('action', 'parsers', AliasedSubParsersAction)
 
-        versions = []
-        for pkg in [_f for _f in [getattr(self, 'package_name', None), 'workspace-tools'] if _f]:
-            try:
-                versions.append('%s %s' % (pkg, pkg_resources.get_distribution(pkg).version))
-            except Exception:
-                pass
+        packages = [_f for _f in [getattr(self, 'package_name', None), 'workspace-tools'] if _f]
 
-        self.parser.add_argument('-v', '--version', action='version', version='\n'.join(versions))
+        self.parser.add_argument('-v', '--version', action=PackageVersionAction, packages=packages)
         self.parser.add_argument('--debug', action='store_true', help='Turn on debug mode')
 
-    def setup_parsers(self):
+    def setup_parsers(self, names=None):
         """
-          Sets up parsers for all commands
+          Sets up parsers for commands
+
+          :param list names: Names of commands to setup parsers for. Defaults to all commands.
         """
 
         self._setup_parser()
@@ -131,7 +206,8 @@ class Commander(object):
         self.subparsers = self.parser.add_subparsers(title='sub-commands', help='List of sub-commands', dest='command')
         self.subparsers.remove_parser = lambda *args, **kwargs: _remove_parser(self.subparsers, *args, **kwargs)
 
-        for name, command in sorted(self.commands().items()):
+        for name in sorted(names or self.command_names()):
+            command = self.command(name)
             doc, _ = command.docs()
             help = list(filter(None, doc.split('\n')))[0]
             aliases = [command.alias] if command.alias else None
@@ -156,6 +232,29 @@ class Commander(object):
                     group.add_argument(*args, **kwargs)
 
 
+class PackageVersionAction(argparse.Action):
+    """ Same as argparse's "version" action, but only looks up the package versions when the option is used. """
+
+    def __init__(self, option_strings, packages, dest=argparse.SUPPRESS, default=argparse.SUPPRESS,
+                 help="show program's version number and exit"):
+        super(PackageVersionAction, self).__init__(option_strings=option_strings, dest=dest, default=default, nargs=0,
+                                                   help=help)
+        self.packages = packages
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        import pkg_resources
+
+        versions = []
+        for pkg in self.packages:
+            try:
+                versions.append('%s %s' % (pkg, pkg_resources.get_distribution(pkg).version))
+            except Exception:
+                pass
+
+        parser._print_message('\n'.join(versions) + '\n', sys.stdout)
+        parser.exit()
+
+
 # Copied from https://gist.github.com/sampsyo/471779
 class AliasedSubParsersAction(argparse._SubParsersAction):
 
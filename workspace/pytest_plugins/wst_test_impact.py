@@ -0,0 +1,183 @@
+"""
+Pytest plugin to record / use the test impact map of a test env. It is loaded by `wst test` with `-p wst_test_impact`
+when test impact analysis is enabled, so it should only use the standard library.
+
+The map is a JSON file with:
+
+    commit: Commit that the map was recorded at
+    files: List of files (relative to the repo) that were run by tests
+    tests: Map of test id to indexes of the files that it ran (including its own test file)
+    failed: List of test ids that failed in the last run
+
+Files are recorded with a profile hook (called for each Python function call only) instead of a trace hook, so
+recording only costs a little more than a normal run. Repo modules imported by the test module are added for each
+test too, as their module level code runs at collection.
+"""
+from __future__ import absolute_import
+import ast
+import glob
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('wst', 'test impact analysis for wst test')
+    group.addoption('--wst-impact-map', help='Path to the test impact map')
+    group.addoption('--wst-impact-commit', help='Record the test impact map at the commit')
+    group.addoption('--wst-impact-select', help='Only run tests in the JSON file with "tests" and "files" to select')
+
+
+def pytest_configure(config):
+    if config.getoption('wst_impact_map'):
+        config.pluginmanager.register(TestImpact(config), 'wst_test_impact_recorder')
+
+
+def _read_json(path):
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def _write_json(path, data):
+    with open(path + '.tmp', 'w') as fp:
+        json.dump(data, fp)
+    os.rename(path + '.tmp', path)
+
+
+class TestImpact(object):
+    __test__ = False
+
+    def __init__(self, config):
+        self.map_file = config.getoption('wst_impact_map')
+        self.commit = config.getoption('wst_impact_commit')
+        self.select_file = config.getoption('wst_impact_select')
+        self.worker_id = getattr(config, 'workerinput', {}).get('workerid')
+        self.root = os.getcwd() + os.sep
+        self.test_files = {}
+        self.imported_files = {}
+        self.failed = set()
+        self.passed = set()
+
+        if not self.worker_id:
+            for worker_file in glob.glob(self.map_file + '.gw*'):
+                os.unlink(worker_file)
+
+    def pytest_collection_modifyitems(self, config, items):
+        if not self.select_file:
+            return
+
+        selection = _read_json(self.select_file)
+        tests = set(selection['tests'])
+        files = set(selection['files'])
+        selected = []
+        deselected = []
+
+        for item in items:
+            if item.nodeid in tests or os.path.relpath(str(item.fspath)) in files:
+                selected.append(item)
+            else:
+                deselected.append(item)
+
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = selected
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        if self.select_file or not self.commit:
+            yield
+            return
+
+        files = set()
+        root = self.root
+
+        def profile(frame, event, arg):
+            if event == 'call':
+                files.add(frame.f_code.co_filename)
+
+        sys.setprofile(profile)
+        threading.setprofile(profile)
+
+        try:
+            yield
+        finally:
+            sys.setprofile(None)
+            threading.setprofile(None)
+
+        files.add(str(item.fspath))
+        files.update(self._imported_files(str(item.fspath)))
+        self.test_files[item.nodeid] = sorted(f[len(root):] for f in files
+                                              if f.startswith(root) and not f[len(root):].startswith('.tox' + os.sep))
+
+    def _imported_files(self, path):
+        """ Files of repo modules that are imported by the test module at path (from its import statements) """
+        if path not in self.imported_files:
+            files = set()
+
+            try:
+                with open(path) as fp:
+                    tree = ast.parse(fp.read())
+            except Exception:
+                tree = None
+
+            for node in ast.walk(tree) if tree else []:
+                if isinstance(node, ast.Import):
+                    names = [alias.name for alias in node.names]
+                elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                    names = [node.module] + [node.module + '.' + alias.name for alias in node.names]
+                else:
+                    continue
+
+                for name in names:
+                    module_file = getattr(sys.modules.get(name), '__file__', None)
+                    if module_file and module_file.startswith(self.root):
+                        files.add(module_file)
+
+            self.imported_files[path] = files
+
+        return self.imported_files[path]
+
+    def pytest_runtest_logreport(self, report):
+        if self.worker_id:
+            return  # Outcomes are recorded by the controller
+
+        if report.failed:
+            self.failed.add(report.nodeid)
+        elif report.when == 'call':
+            self.passed.add(report.nodeid)
+
+    def pytest_sessionfinish(self, session, exitstatus):
+        if self.worker_id:
+            if self.test_files:
+                _write_json('{}.{}'.format(self.map_file, self.worker_id), self.test_files)
+            return
+
+        if self.select_file and exitstatus == 5:  # All tests deselected
+            session.exitstatus = exitstatus = 0
+
+        if exitstatus not in (0, 1):  # Interrupted or collection errors
+            return
+
+        if self.select_file or not self.commit:
+            try:
+                impact_map = _read_json(self.map_file)
+            except Exception:
+                return
+            impact_map['failed'] = sorted(set(impact_map.get('failed', [])) - self.passed | self.failed)
+            _write_json(self.map_file, impact_map)
+            return
+
+        test_files = self.test_files
+        for worker_file in glob.glob(self.map_file + '.gw*'):
+            test_files.update(_read_json(worker_file))
+            os.unlink(worker_file)
+
+        files = sorted(set(f for fs in test_files.values() for f in fs))
+        indexes = dict((f, i) for i, f in enumerate(files))
+        _write_json(self.map_file, {'commit': self.commit,
+                                    'files': files,
+                                    'tests': dict((t, [indexes[f] for f in fs]) for t, fs in test_files.items()),
+                                    'failed': sorted(self.failed)})
@@ -1,29 +1,431 @@
 from __future__ import absolute_import
+from collections import namedtuple
+from functools import wraps
+import json
 import logging
 import os
 import re
+import shutil
+import stat
 import sys
+import tempfile
+import threading
+import time
 
 import click
-import requests
+from six.moves.urllib.parse import urlparse
 from utils.process import run, silent_run
 
-from workspace.config import config
-from workspace.utils import parent_path_with_dir, parent_path_with_file, shortest_id
+from workspace.config import config, CACHE_DIR
+from workspace.utils import (default_workers, invalidate_parent_paths, parallel_map, parent_path_with_dir,
+                             parent_path_with_file, shortest_id)
 
 
 log = logging.getLogger(__name__)
 
-REMOTE_BRANCH_RE = re.compile(r'^(\*)? *(\((?:HEAD detached at|no branch, rebasing) )?([^ )]+)\)? +\w+ +(?:\[(.+)/([^:\] ]+).*])?')
 DEFAULT_REMOTE = 'origin'
 UPSTREAM_REMOTE = 'upstream'
+PRODUCT_NAME_RE = re.compile(r'^[\w-]+$')
 USER_REPO_REFERENCE_RE = re.compile('^[\w-]+/[\w-]+$')
 
+#: Map of clone strategy to its git clone options. See [checkout] clone_strategy config.
+CLONE_STRATEGIES = {
+    'full': [],
+    'blobless': ['--filter=blob:none'],
+    'treeless': ['--filter=tree:0'],
+    'shallow': ['--depth', '{depth}', '--no-single-branch'],
+    'single-branch': ['--single-branch'],
+}
+
 
 class SCMError(Exception):
     """ SCM command failed """
 
 
+#: A branch from :attr:`RepoState.branches`. Name is the display name from `git branch`, and upstream_remote is
+#: None when the branch does not track a remote branch.
+Branch = namedtuple('Branch', 'name ref commit current detached upstream upstream_remote symref')
+
+
+class RepoState(object):
+    """
+    Snapshot of a repo's branches, remotes, and working tree state.
+
+    Each part is collected with a single git call the first time it is needed, and then shared by the scm helpers
+    until :func:`invalidate_repo_state` is called by a mutating helper or at the end of a command run.
+    Use :func:`repo_state` to get the cached instance for a repo instead of creating one directly.
+    """
+    BRANCH_FORMAT = '\t'.join(['%(HEAD)', '%(refname)', '%(objectname:short)', '%(upstream:short)',
+                               '%(upstream:remotename)', '%(symref:lstrip=1)'])
+
+    def __init__(self, repo=None):
+        """
+        :param str repo: Path to repo. Defaults to current working directory.
+        """
+        self.repo = repo
+        self._branches = None
+        self._remotes = None
+        self._dirty = None
+
+    def _load_branches(self):
+        output = silent_run(['git', 'branch', '--all', '--format=' + self.BRANCH_FORMAT], cwd=self.repo,
+                            return_output=True)
+        branches = []
+
+        for line in output.split('\n'):
+            parts = line.split('\t')
+            if len(parts) != 6:
+                continue  # Not a git repo or no commits yet
+
+            head, ref, commit, upstream, upstream_remote, symref = parts
+            current = head == '*'
+            detached = ref.startswith('(')
+
+            if detached:
+                name = ref
+            elif ref.startswith('refs/heads/'):
+                name = ref[len('refs/heads/'):]
+            else:
+                name = ref[len('refs/'):]
+                if symref:
+                    name += ' -> ' + symref[len('remotes/'):]
+
+            branches.append(Branch(name, ref, commit, current, detached, upstream or None,
+                                   upstream_remote if upstream_remote not in ('', '.') else None, symref or None))
+
+        return branches
+
+    @property
+    def branches(self):
+        """ List of :class:`Branch` for local and remote branches in the order listed by `git branch --all` """
+        if self._branches is None:
+            self._branches = self._load_branches()
+        return self._branches
+
+    @property
+    def local_branches(self):
+        return [b for b in self.branches if not b.ref.startswith('refs/remotes/')]
+
+    @property
+    def current(self):
+        """ Current :class:`Branch` or None if there are no commits yet """
+        for branch in self.branches:
+            if branch.current:
+                return branch
+
+    @property
+    def head(self):
+        """ Short commit id of HEAD or None if there are no commits yet """
+        return self.current and self.current.commit
+
+    @property
+    def remotes(self):
+        """ Map of remote name to its (fetch) url in the order listed by `git remote -v` """
+        if self._remotes is None:
+            output = silent_run('git remote -v', cwd=self.repo, return_output=True)
+            remotes = {}
+
+            for line in output.split('\n'):
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == '(fetch)':
+                    remotes[parts[0]] = parts[1]
+
+            self._remotes = remotes
+
+        return self._remotes
+
+    @property
+    def dirty(self):
+        """ True if there are modified, staged, or untracked files """
+        if self._dirty is None:
+            output, success = silent_run('git status --porcelain', cwd=self.repo, return_output=2)
+            self._dirty = not success or bool(output.strip())
+        return self._dirty
+
+
+_repo_states = {}
+_repo_states_lock = threading.Lock()
+
+
+def repo_state(repo=None):
+    """ Returns the cached :class:`RepoState` for the given or current repo """
+    path = os.path.abspath(repo or os.getcwd())
+
+    with _repo_states_lock:
+        if path not in _repo_states:
+            _repo_states[path] = RepoState(path)
+        return _repo_states[path]
+
+
+def invalidate_repo_state():
+    """ Drop all cached :class:`RepoState` so the next scm call sees the latest state """
+    with _repo_states_lock:
+        _repo_states.clear()
+
+
+def changes_repo_state(func):
+    """ Decorator for scm helpers that change repo state to invalidate cached :class:`RepoState` afterwards """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            invalidate_repo_state()
+    return wrapper
+
+
+class WorkspaceIndex(object):
+    """
+    Persistent index of product checkouts in workspaces, so commands don't need to rescan a workspace on every call.
+
+    Each checkout is recorded with its path, product name, remotes, and .git mtime. On each use, the workspace is
+    only rescanned if its mtime changed (i.e. a checkout was added or removed) or the mtime of a dir in it that is not
+    a checkout changed (i.e. it may have become one from a `git init` or clone into it), and each checkout is
+    revalidated with a single stat of its .git, which refreshes the remotes from .git/config (without running git)
+    when it changed.
+    Use :func:`workspace_index` to get the shared instance.
+    """
+    REMOTE_SECTION_RE = re.compile(r'^\s*\[remote "(.+)"\]')
+    SECTION_RE = re.compile(r'^\s*\[')
+    URL_RE = re.compile(r'^\s*url\s*=\s*(.+?)\s*$')
+
+    def __init__(self, index_file=None):
+        """
+        :param str index_file: Path to the index file. Defaults to workspaces.json in :data:`CACHE_DIR`
+        """
+        self.index_file = index_file or os.path.join(CACHE_DIR, 'workspaces.json')
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._index is None:
+            try:
+                with open(os.path.expanduser(self.index_file)) as fp:
+                    self._index = json.load(fp)
+            except Exception as e:
+                log.debug('Could not load workspace index: %s', e)
+                self._index = {}
+
+        return self._index
+
+    def _save(self):
+        index_file = os.path.expanduser(self.index_file)
+        index = dict((w, i) for w, i in self._index.items() if os.path.isdir(w))
+
+        try:
+            if not os.path.exists(os.path.dirname(index_file)):
+                os.makedirs(os.path.dirname(index_file))
+
+            temp_file = '{}.{}.tmp'.format(index_file, os.getpid())
+            with open(temp_file, 'w') as fp:
+                json.dump(index, fp)
+            os.rename(temp_file, index_file)
+
+        except Exception as e:
+            log.debug('Could not save workspace index: %s', e)
+
+    @classmethod
+    def _git_mtime(cls, path):
+        """ Returns mtime (ns) of .git dir in path or None if path is not a repo """
+        try:
+            git_stat = os.stat(os.path.join(path, '.git'))
+        except OSError:
+            return None
+
+        return git_stat.st_mtime_ns if stat.S_ISDIR(git_stat.st_mode) else None
+
+    @classmethod
+    def _remotes(cls, path):
+        """ Map of remote name to url from .git/config """
+        remotes = {}
+        remote = None
+
+        try:
+            with open(os.path.join(path, '.git', 'config')) as fp:
+                for line in fp:
+                    match = cls.REMOTE_SECTION_RE.match(line)
+                    if match:
+                        remote = match.group(1)
+                    elif cls.SECTION_RE.match(line):
+                        remote = None
+                    elif remote:
+                        match = cls.URL_RE.match(line)
+                        if match:
+                            remotes.setdefault(remote, match.group(1))
+
+        except IOError as e:
+            log.debug('Could not read remotes for %s: %s', path, e)
+
+        return remotes
+
+    def _entry(self, path, git_mtime):
+        return {'path': path, 'name': product_name(path), 'remotes': self._remotes(path), 'git_mtime': git_mtime}
+
+    @classmethod
+    def _dir_mtime(cls, path):
+        """ Returns mtime (ns) of path or None if it is not a dir """
+        try:
+            path_stat = os.stat(path)
+        except OSError:
+            return None
+
+        return path_stat.st_mtime_ns if stat.S_ISDIR(path_stat.st_mode) else None
+
+    def _scan(self, workspace_dir):
+        """ Returns tuple of checkout entries and map of other dir paths to their mtime in the workspace """
+        entries = []
+        dirs = {}
+
+        for name in sorted(os.listdir(workspace_dir)):
+            path = os.path.join(workspace_dir, name)
+            git_mtime = self._git_mtime(path)
+            if git_mtime:
+                entries.append(self._entry(path, git_mtime))
+            else:
+                dir_mtime = self._dir_mtime(path)
+                if dir_mtime:
+                    dirs[path] = dir_mtime
+
+        return entries, dirs
+
+    def entries(self, workspace_dir):
+        """
+        List of checkouts in the workspace sorted by path, where each checkout is a dict with keys:
+        path, name (product name), remotes (map of remote name to url), and git_mtime.
+
+        :param str workspace_dir: Path to workspace
+        """
+        workspace_dir = os.path.abspath(workspace_dir)
+
+        try:
+            mtime = os.stat(workspace_dir).st_mtime_ns
+        except OSError:
+            return []
+
+        with self._lock:
+            index = self._load()
+            workspace = index.get(workspace_dir)
+            changed = False
+
+            if workspace and (workspace['mtime'] != mtime or 'dirs' not in workspace
+                              or any(self._dir_mtime(p) != m for p, m in workspace['dirs'].items())):
+                workspace = None
+
+            if workspace:
+                for i, entry in enumerate(workspace['repos']):
+                    git_mtime = self._git_mtime(entry['path'])
+                    if not git_mtime:
+                        workspace = None  # Checkout is no longer a repo
+                        break
+                    if git_mtime != entry['git_mtime']:
+                        workspace['repos'][i] = self._entry(entry['path'], git_mtime)
+                        changed = True
+
+            if not workspace:
+                repos, dirs = self._scan(workspace_dir)
+                workspace = index[workspace_dir] = {'mtime': mtime, 'repos': repos, 'dirs': dirs}
+                changed = True
+
+            if changed:
+                self._save()
+
+            return list(workspace['repos'])
+
+    def repos(self, workspace_dir):
+        """ List of checkout paths in the workspace """
+        return [e['path'] for e in self.entries(workspace_dir)]
+
+    def products(self, workspace_dir):
+        """
+        Map of product name to checkout path in the workspace. When there are multiple checkouts for a product (e.g.
+        foo and foo_trunk), the one with the product name as its dir name is used, or else the first by path.
+        """
+        products = {}
+
+        for entry in self.entries(workspace_dir):
+            if entry['name'] not in products or os.path.basename(entry['path']) == entry['name']:
+                products[entry['name']] = entry['path']
+
+        return products
+
+    def invalidate(self, workspace_dir=None):
+        """ Drop the given or all workspaces from the index so they are rescanned on next use """
+        with self._lock:
+            index = self._load()
+            if workspace_dir:
+                index.pop(os.path.abspath(workspace_dir), None)
+            else:
+                index.clear()
+            self._save()
+
+
+_workspace_index = WorkspaceIndex()
+
+
+def workspace_index():
+    """ Returns the shared :class:`WorkspaceIndex` """
+    return _workspace_index
+
+
+class SSHMultiplexer(object):
+    """
+    Share one SSH connection per git host for git calls made while it is active.
+
+    Git's SSH command is set to use a control master socket per user / host / port in a temp dir, so the first git
+    call to a host sets up the connection and the rest reuse it. The connections are closed when stopped.
+    Use as a context manager, or call :meth:`start` / :meth:`stop`.
+    """
+
+    def __init__(self, control_persist=None):
+        """
+        :param int control_persist: Seconds to keep a connection open after its last use.
+                                    Defaults to [ssh] control_persist config.
+        """
+        self.control_persist = control_persist or config.ssh.control_persist
+        self.control_dir = None
+        self._ssh_command = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def hosts(self):
+        """ List of "user@host:port" that have a shared connection """
+        if not self.control_dir or not os.path.isdir(self.control_dir):
+            return []
+        return sorted(os.listdir(self.control_dir))
+
+    def start(self):
+        """ Set git's SSH command to share connections unless git's SSH command is already customized """
+        if self.control_dir or os.environ.get('GIT_SSH') or os.environ.get('GIT_SSH_COMMAND'):
+            return
+
+        # Socket paths are limited to about 100 chars, so use a short temp dir instead of CACHE_DIR
+        self.control_dir = tempfile.mkdtemp(prefix='wst-ssh-')
+        self._ssh_command = 'ssh -o ControlMaster=auto -o ControlPath={}/%r@%h:%p -o ControlPersist={}'.format(
+            self.control_dir, self.control_persist)
+        os.environ['GIT_SSH_COMMAND'] = self._ssh_command
+
+    def stop(self):
+        """ Close the shared connections and restore git's SSH command """
+        if not self.control_dir:
+            return
+
+        if os.environ.get('GIT_SSH_COMMAND') == self._ssh_command:
+            del os.environ['GIT_SSH_COMMAND']
+
+        for host in self.hosts:
+            silent_run(['ssh', '-o', 'ControlPath=' + os.path.join(self.control_dir, host), '-O', 'exit', host],
+                       raises=False)
+
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+        self.control_dir = None
+
+
 def workspace_path():
     """ Guess the workspace path based on if we are in a repo or not. """
     repo_path = is_repo()
@@ -44,6 +446,18 @@ def commit_logs(limit=None, repo=None, diff=False, show_revision=None, extra_arg
         cmd.extend(['-U', show_revision])
     if limit:
         cmd.append('-%d' % limit)
+
+    if is_shallow(repo):
+        if show_revision and not silent_run(['git', 'cat-file', '-e', show_revision + '^{commit}'], cwd=repo,
+                                            raises=False):
+            deepen_repo(repo)
+        elif limit:
+            commits = int(silent_run(['git', 'rev-list', '--count', 'HEAD'], cwd=repo, return_output=True))
+            if commits < limit:
+                deepen_repo(repo, limit - commits)
+        else:
+            deepen_repo(repo)
+
     if diff:
         cmd.append('-c')
     if extra_args:
@@ -52,6 +466,7 @@ def commit_logs(limit=None, repo=None, diff=False, show_revision=None, extra_arg
     return run(cmd, return_output=not to_pager, shell=to_pager, cwd=repo)
 
 
+@changes_repo_state
 def add_files(files=None):
     if files:
         files = ' '.join(files)
@@ -122,21 +537,15 @@ def product_repos():
 
 def repos(dir=None):
     """ Returns a list of repos either for the given directory or current directory or in sub-directories. """
-    repos = []
     cwd = dir or os.getcwd()
 
     if is_repo(cwd):
-        repos.append(repo_path(cwd))
-        return repos
+        return [repo_path(cwd)]
 
-    for dir in os.listdir(cwd):
-        path = os.path.join(cwd, dir)
-        if os.path.isdir(path) and is_repo(path):
-            repos.append(path)
-
-    return repos
+    return workspace_index().repos(cwd)
 
 
+@changes_repo_state
 def checkout_branch(branch, repo_path=None):
     """
     Checks out the branch in the given or current repo. Raises on error.
@@ -154,6 +563,7 @@ def checkout_branch(branch, repo_path=None):
         cmd.extend(['-B', name])
 
     silent_run(cmd, cwd=repo_path)
+    invalidate_repo_state()
 
     if name:
         upstream_branch = '{}/{}'.format(upstream_remote(), name)
@@ -163,6 +573,7 @@ def checkout_branch(branch, repo_path=None):
             click.echo('FYI Can not change upstream tracking branch to {} as it does not exist'.format(upstream_branch))
 
 
+@changes_repo_state
 def create_branch(branch, from_branch=None):
     """ Creates a branch from the current branch. Raises on error """
     cmd = ['git', 'checkout', '-b', branch]
@@ -171,10 +582,12 @@ def create_branch(branch, from_branch=None):
     silent_run(cmd)
 
 
+@changes_repo_state
 def update_branch(repo=None, parent='master'):
     silent_run('git rebase {}'.format(parent), cwd=repo)
 
 
+@changes_repo_state
 def remove_branch(branch, raises=False, remote=False, force=False):
     """ Removes branch """
     run(['git', 'branch', '-D' if force else '-d', branch], raises=raises)
@@ -183,10 +596,12 @@ def remove_branch(branch, raises=False, remote=False, force=False):
         silent_run(['git', 'push', default_remote(), '--delete', branch], raises=raises)
 
 
+@changes_repo_state
 def rename_branch(branch, new_branch):
     silent_run(['git', 'branch', '-m', branch, new_branch])
 
 
+@changes_repo_state
 def merge_branch(branch, commit=None, squash=False, strategy=None):
     cmd = ['git', 'merge', branch]
     if squash:
@@ -220,14 +635,7 @@ def all_remotes(repo=None):
 
 def _all_remotes(repo=None):
     """ Returns all remotes. """
-    remotes_output = silent_run('git remote', cwd=repo, return_output=True)
-    remotes = []
-
-    if remotes_output:
-        for remote in remotes_output.split('\n'):
-            if remote:
-                remote = remote.strip()
-                remotes.append(remote)
+    remotes = list(repo_state(repo).remotes)
 
     required_remotes = {
         DEFAULT_REMOTE: 'Your fork of the upstream repo',
@@ -263,58 +671,45 @@ def upstream_remote(repo=None, remotes=None):
 
 
 def remote_tracking_branch(repo=None):
-    remote_output = silent_run('git rev-parse --abbrev-ref --symbolic-full-name @{u}', cwd=repo, return_output=True)
-
-    if 'no upstream' in remote_output:
-        return None
-    else:
-        return remote_output
+    """ Returns the remote tracking branch (e.g. origin/master) of the current branch or None if not set """
+    current = repo_state(repo).current
+    return current and current.upstream_remote and current.upstream or None
 
 
 def all_branches(repo=None, remotes=False, verbose=False):
     """ Returns all branches. The first element is the current branch. """
-    cmd = ['git', 'branch']
-    if remotes:
-        cmd.append('--all')
-    if verbose:
-        cmd.append('-vv')
-
-    branch_output = silent_run(cmd, cwd=repo, return_output=True)
+    state = repo_state(repo)
     branches = []
-    remotes = all_remotes(repo=repo)
-    up_remote = remotes and upstream_remote(repo=repo, remotes=remotes)
-    def_remote = remotes and default_remote(repo=repo, remotes=remotes)
-
-    if branch_output:
-        for branch in branch_output.split('\n'):
-            branch = branch.strip()
-            if branch:
-                if verbose:
-                    star, detached, local_branch, remote, branch = REMOTE_BRANCH_RE.search(branch).groups()
-                    if remote and remotes:
-                        # Rightful/tracking remote differs based on parent vs child branch:
-                        #   Parent branch = upstream remote
-                        #   Child branch = origin remote
-                        rightful_remote = (remote == up_remote and '@' not in local_branch or
-                                           remote == def_remote and '@' in local_branch)
-                        branch = local_branch if rightful_remote else '{}^{}'.format(local_branch, shortest_id(remote, remotes))
-
-                    elif detached:
-                        branch = local_branch + '*'
-
-                    else:
-                        branch = local_branch
-
-                    if star:
-                        branches.insert(0, branch)
-                    else:
-                        branches.append(branch)
-
-                else:
-                    if branch.startswith('*'):
-                        branches.insert(0, branch.strip('* '))
-                    else:
-                        branches.append(branch)
+    remote_names = all_remotes(repo=repo)
+    up_remote = remote_names and upstream_remote(repo=repo, remotes=remote_names)
+    def_remote = remote_names and default_remote(repo=repo, remotes=remote_names)
+
+    for branch in (state.branches if remotes else state.local_branches):
+        name = branch.name
+
+        if verbose:
+            local_branch = name.split()[-1].rstrip(')') if branch.detached else name
+            remote = branch.upstream_remote
+
+            if remote and remote_names:
+                # Rightful/tracking remote differs based on parent vs child branch:
+                #   Parent branch = upstream remote
+                #   Child branch = origin remote
+                rightful_remote = (remote == up_remote and '@' not in local_branch or
+                                   remote == def_remote and '@' in local_branch)
+                name = local_branch if rightful_remote else '{}^{}'.format(local_branch,
+                                                                           shortest_id(remote, list(remote_names)))
+
+            elif branch.detached:
+                name = local_branch + '*'
+
+            else:
+                name = local_branch
+
+        if branch.current:
+            branches.insert(0, name)
+        else:
+            branches.append(name)
 
     return branches
 
@@ -338,6 +733,7 @@ def parent_branch(branch):
         return parent
 
 
+@changes_repo_state
 def update_repo(path=None, quiet=False):
     """ Updates given or current repo to HEAD """
     if not remote_tracking_branch(repo=path):
@@ -353,10 +749,28 @@ def update_repo(path=None, quiet=False):
     remotes = all_remotes(repo=path)
     failed_remotes = []
 
-    for remote in remotes:
+    def fetch_remote(remote):
+        fetch_cmd = 'git fetch --tags {0} +refs/heads/{1}:refs/remotes/{0}/{1}'.format(remote, branch)
+        output, success = silent_run(fetch_cmd, cwd=path, return_output=2)
+
+        # Remotes usually share tags, so concurrent fetches may race on the same tag ref. Retry once if so.
+        if not success and 'lock' in output:
+            output, success = silent_run(fetch_cmd, cwd=path, return_output=2)
+
+        return output, success
+
+    # Fetch from all remotes at the same time, and then fast-forward locally one remote at a time like pull does.
+    for remote, (output, success) in zip(remotes, parallel_map(fetch_remote, remotes)):
         if len(remotes) > 1 and not quiet:
             click.echo('    ... from ' + remote)
-        output, success = silent_run('git pull --ff-only --tags {} {}'.format(remote, branch), cwd=path, return_output=2)
+        if success:
+            merge_cmd = 'git merge --ff-only refs/remotes/{}/{}'.format(remote, branch)
+            output, success = silent_run(merge_cmd, cwd=path, return_output=2)
+
+            # The merge base may be beyond the history of a shallow clone
+            if not success and is_shallow(path):
+                deepen_repo(path)
+                output, success = silent_run(merge_cmd, cwd=path, return_output=2)
         if not success:
             error_match = re.search(r'(?:fatal|ERROR): (.+)', output)
             error = error_match.group(1) if error_match else output
@@ -367,10 +781,31 @@ def update_repo(path=None, quiet=False):
         raise SCMError('Failed to pull from remote(s): {}'.format(', '.join(failed_remotes)))
 
 
+def is_shallow(repo=None):
+    """ True if the repo only has partial history from a shallow clone """
+    return os.path.exists(os.path.join(repo or repo_path(), '.git', 'shallow'))
+
+
+@changes_repo_state
+def deepen_repo(repo=None, commits=None):
+    """
+    Fetch more history for a shallow repo. Failure is ignored (e.g. when offline) as history is only fetched on demand.
+
+    :param str repo: Path to repo. Defaults to current repo.
+    :param int commits: Number of commits to deepen by. Defaults to fetching all history.
+    """
+    deepen_opt = '--deepen={}'.format(commits) if commits else '--unshallow'
+    output, success = silent_run(['git', 'fetch', deepen_opt], cwd=repo, return_output=2)
+    if not success:
+        log.debug('Could not fetch more history for shallow repo: %s', output)
+
+
+@changes_repo_state
 def update_tags(remote, path=None):
     silent_run('git fetch --tags {}'.format(remote), cwd=path)
 
 
+@changes_repo_state
 def push_repo(path=None, force=False, remote=None, branch=None):
     push_opts = []
 
@@ -396,6 +831,114 @@ def stat_repo(path=None, return_output=False, with_color=False):
     return run(cmd, cwd=path, return_output=return_output)
 
 
+def repo_status(path=None):
+    """
+    Status of the repo from `git status --porcelain=v2 --branch` as a dict with keys:
+    branch (None when detached), commit (None before first commit), upstream, ahead, behind, changes (list of dict
+    with path, status, and orig_path for renames / copies), and clean (True if there are no changes and branch is
+    not ahead or behind of upstream).
+
+    Status is the 2 char XY code from git status --porcelain, e.g. " M" or "??" for untracked files.
+
+    If git status fails (e.g. the repo is broken), the dict also has error with the git output and clean is False.
+    """
+    output, success = silent_run(['git', 'status', '--porcelain=v2', '--branch', '-z'], cwd=path, return_output=2)
+    status = {'branch': None, 'commit': None, 'upstream': None, 'ahead': 0, 'behind': 0, 'changes': []}
+
+    if not success:
+        status.update(clean=False, error=output.strip())
+        return status
+
+    entries = iter(output.split('\0'))
+
+    for entry in entries:
+        if entry.startswith('# branch.'):
+            key, value = entry[len('# branch.'):].split(' ', 1)
+            if key == 'oid' and value != '(initial)':
+                status['commit'] = value
+            elif key == 'head' and value != '(detached)':
+                status['branch'] = value
+            elif key == 'upstream':
+                status['upstream'] = value
+            elif key == 'ab':
+                ahead, behind = value.split()
+                status['ahead'], status['behind'] = int(ahead), abs(int(behind))
+
+        elif entry.startswith('1 '):
+            fields = entry.split(' ', 8)
+            status['changes'].append({'path': fields[8], 'status': fields[1].replace('.', ' ')})
+
+        elif entry.startswith('2 '):
+            fields = entry.split(' ', 9)
+            status['changes'].append({'path': fields[9], 'status': fields[1].replace('.', ' '),
+                                      'orig_path': next(entries)})
+
+        elif entry.startswith('u '):
+            fields = entry.split(' ', 10)
+            status['changes'].append({'path': fields[10], 'status': fields[1]})
+
+        elif entry.startswith('? '):
+            status['changes'].append({'path': entry[2:], 'status': '??'})
+
+    status['clean'] = not (status['changes'] or status['ahead'] or status['behind'])
+
+    return status
+
+
+def clean_state(path=None):
+    """
+    Quick check of what would be lost if the repo was removed, which is safe to call for many repos in parallel.
+
+    It is based on a single `git status --porcelain=v2` (locale independent) for changes and commits not pushed
+    to upstream, and the cached :class:`RepoState` for local branches.
+
+    :return: Dict with keys: clean (True if there are no changes, including untracked files, and the branch is not
+             ahead of upstream. Being behind is clean as nothing would be lost), changes (number of changed /
+             untracked files), ahead, behind, and branches (local branch names). If git status fails, clean is False
+             and error has the git output.
+    """
+    status = repo_status(path)
+
+    if 'error' in status:
+        return {'clean': False, 'changes': 0, 'ahead': 0, 'behind': 0, 'branches': [], 'error': status['error']}
+
+    return {'clean': not (status['changes'] or status['ahead']), 'changes': len(status['changes']),
+            'ahead': status['ahead'], 'behind': status['behind'],
+            'branches': [b.name for b in repo_state(path).local_branches]}
+
+
+def diff_stats(path=None, branch=None, context=None):
+    """
+    Changed files from `git diff --numstat` as a list of dict with path, added, and deleted (number of lines, or None
+    for binary files).
+    """
+    cmd = ['git', 'diff', '--numstat', '-z']
+    if branch:
+        cmd.append(branch)
+    if context:
+        cmd.append(context)
+
+    output = silent_run(cmd, cwd=path, return_output=True)
+    stats = []
+    entries = iter(output.split('\0'))
+
+    for entry in entries:
+        if not entry:
+            continue
+
+        added, deleted, file_path = entry.split('\t', 2)
+        stat = {'path': file_path,
+                'added': None if added == '-' else int(added),
+                'deleted': None if deleted == '-' else int(deleted)}
+
+        if not file_path:  # Renames are followed by the old and new path
+            stat['orig_path'], stat['path'] = next(entries), next(entries)
+
+        stats.append(stat)
+
+    return stats
+
+
 def diff_repo(path=None, branch=None, context=None, return_output=False, name_only=False, color=False):
     cmd = ['git', 'diff']
     if name_only:
@@ -410,12 +953,14 @@ def diff_repo(path=None, branch=None, context=None, return_output=False, name_on
     return run(cmd, cwd=path, return_output=return_output)
 
 
+@changes_repo_state
 def commit_changes(msg):
     """ Commits any modified or new files with given message. Raises on error """
     silent_run(['git', 'commit', '-am', msg])
     click.echo('Committed change.')
 
 
+@changes_repo_state
 def local_commit(msg=None, amend=False, empty=False):
     cmd = ['git', 'commit']
     if amend:
@@ -427,52 +972,312 @@ def local_commit(msg=None, amend=False, empty=False):
     run(cmd)
 
 
-def checkout_product(product_url, checkout_path):
-    """ Checks out the product from url. Raises on error """
+class RepoSearch(object):
+    """
+    Resolve product names to repo urls using the search API ([checkout] search_api_url config).
+
+    Resolved urls are cached on disk for [checkout] search_cache_days, so checking out a known product again does not
+    make any request. Requests share one HTTP session, and are retried with backoff when rate limited.
+    Use :func:`repo_search` to get the shared instance.
+    """
+    #: Max number of tries for a rate limited search
+    MAX_TRIES = 5
+
+    #: Max seconds to wait before retrying a rate limited search
+    MAX_BACKOFF = 60
+
+    def __init__(self, cache_file=None, cache_days=None):
+        """
+        :param str cache_file: Path to the cache file. Defaults to repo_search.json in :data:`CACHE_DIR`
+        :param float cache_days: Days to cache resolved urls for. Defaults to [checkout] search_cache_days config.
+        """
+        self.cache_file = cache_file or os.path.join(CACHE_DIR, 'repo_search.json')
+        self.cache_days = cache_days if cache_days is not None else config.checkout.search_cache_days
+        self._cache = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._cache is None:
+            try:
+                with open(os.path.expanduser(self.cache_file)) as fp:
+                    self._cache = json.load(fp)
+            except Exception as e:
+                log.debug('Could not load repo search cache: %s', e)
+                self._cache = {}
+
+        return self._cache
+
+    def _save(self):
+        cache_file = os.path.expanduser(self.cache_file)
+
+        try:
+            if not os.path.exists(os.path.dirname(cache_file)):
+                os.makedirs(os.path.dirname(cache_file))
+
+            temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            with open(temp_file, 'w') as fp:
+                json.dump(self._cache, fp)
+            os.rename(temp_file, cache_file)
+
+        except Exception as e:
+            log.debug('Could not save repo search cache: %s', e)
+
+    @property
+    def session(self):
+        """ HTTP session shared by all searches """
+        if not self._session:
+            import requests
+
+            logging.getLogger('requests').setLevel(logging.WARN)
+            self._session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=default_workers(100, 'thread'))
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+
+        return self._session
+
+    def cached(self, name):
+        """ Cached url for the product name, or None if it is not cached or it has expired """
+        with self._lock:
+            entry = self._load().get(name)
+
+        if entry and time.time() - entry['time'] < float(self.cache_days) * 86400:
+            return entry['url']
+
+    def _backoff(self, response, tries):
+        """ Seconds to wait before retrying the response if it was rate limited, else None """
+        if response.status_code not in (403, 429):
+            return None
+
+        if response.headers.get('Retry-After'):
+            wait = float(response.headers['Retry-After'])
+        elif response.headers.get('X-RateLimit-Remaining') == '0' and response.headers.get('X-RateLimit-Reset'):
+            wait = float(response.headers['X-RateLimit-Reset']) - time.time()
+        elif response.status_code == 429:
+            wait = 2 ** tries
+        else:
+            return None
+
+        return min(max(wait, 1), self.MAX_BACKOFF)
+
+    def _search(self, name):
+        for tries in range(self.MAX_TRIES):
+            try:
+                response = self.session.get(config.checkout.search_api_url, params={'q': name}, timeout=10)
+                wait = self._backoff(response, tries)
+                if wait is None or tries == self.MAX_TRIES - 1:
+                    response.raise_for_status()
+                    results = response.json()['items']
+                    break
+
+            except Exception as e:
+                raise SCMError('Could not find repo for {} using {} due to error: {}'.format(
+                    name, config.checkout.search_api_url, e))
+
+            log.debug('Search for %s is rate limited. Retrying in %d seconds.', name, wait)
+            time.sleep(wait)
+
+        if not results:
+            raise SCMError('No repo matching "{}" found.'.format(name))
+
+        return results[0]['ssh_url']
+
+    def resolve(self, name):
+        """
+        Resolve the product name to its repo url
+
+        :raise SCMError: if the repo could not be found
+        """
+        return self.resolve_all([name])[name]
+
+    def resolve_all(self, names, raises=True):
+        """
+        Resolve the product names to their repo urls. Names that are not cached are searched in parallel, and the
+        cache is saved once after.
+
+        :param list names: Product names to resolve
+        :param bool raises: Raise :class:`SCMError` if any repo could not be found. If False, the name is mapped to
+                            the error instead.
+        :return: Map of product name to its repo url
+        """
+        names = sorted(set(names))
+        urls = dict((name, self.cached(name)) for name in names)
+        search_names = [name for name in names if not urls[name]]
+
+        def search(name):
+            try:
+                return self._search(name)
+            except SCMError as e:
+                return e
+
+        if search_names:
+            for name, url in zip(search_names, parallel_map(search, search_names)):
+                urls[name] = url
+
+            with self._lock:
+                cache = self._load()
+                for name in search_names:
+                    if not isinstance(urls[name], SCMError):
+                        cache[name] = {'url': urls[name], 'time': time.time()}
+                self._save()
+
+        if raises:
+            for url in urls.values():
+                if isinstance(url, SCMError):
+                    raise url
+
+        return urls
+
+
+_repo_search = None
+
+
+def repo_search():
+    """ Returns the shared :class:`RepoSearch` """
+    global _repo_search
+
+    if not _repo_search:
+        _repo_search = RepoSearch()
+
+    return _repo_search
+
+
+def resolve_product_url(product_url):
+    """
+    Resolve a product name (using :func:`repo_search`) or user repo reference (e.g. maxzheng/workspace-tools) to its
+    repo url. Other urls are returned as is.
+
+    :raise SCMError: if the repo could not be found
+    """
+    return resolve_product_urls([product_url], raises=True)[product_url.strip('/')]
+
+
+def resolve_product_urls(product_urls, raises=False):
+    """
+    Resolve the product urls like :func:`resolve_product_url`. Product names are searched in parallel.
+
+    :param list product_urls: Product names, user repo references, or urls
+    :param bool raises: Raise :class:`SCMError` if any repo could not be found.
+    :return: Map of product url to its resolved url, or to :class:`SCMError` if it could not be resolved and raises
+             is False
+    """
+    product_urls = [product_url.strip('/') for product_url in product_urls]
+    names = [product_url for product_url in product_urls if PRODUCT_NAME_RE.match(product_url)]
+    urls = repo_search().resolve_all(names, raises=raises) if names else {}
+
+    for product_url in product_urls:
+        if USER_REPO_REFERENCE_RE.match(product_url):
+            urls[product_url] = config.checkout.user_repo_url % product_url
+        elif product_url not in urls:
+            urls[product_url] = product_url
+
+    return urls
+
+
+@changes_repo_state
+def checkout_product(product_url, checkout_path, quiet=False, clone_strategy=None):
+    """
+    Checks out the product from url, or updates it if it is already checked out. Raises on error
+
+    :param str product_url: Product name, user repo reference, or url. See :func:`resolve_product_url`
+    :param str checkout_path: Path to checkout to
+    :param bool quiet: Don't print update progress
+    :param str clone_strategy: One of :data:`CLONE_STRATEGIES`. Defaults to [checkout] clone_strategy config.
+    """
     product_url = product_url.strip('/')
+    clone_strategy = clone_strategy or config.checkout.clone_strategy
+
+    if clone_strategy not in CLONE_STRATEGIES:
+        raise SCMError('Invalid clone strategy "{}". Valid strategies are: {}'.format(
+            clone_strategy, ', '.join(sorted(CLONE_STRATEGIES))))
 
     prod_name = product_name(product_url)
 
     if os.path.exists(checkout_path):
         log.debug('%s is already checked out.', prod_name)
         checkout_branch('master', checkout_path)
-        return update_repo(checkout_path)
+        return update_repo(checkout_path, quiet=quiet)
 
-    if re.match('[\w-]+$', product_url):
-        try:
-            logging.getLogger('requests').setLevel(logging.WARN)
-            response = requests.get(config.checkout.search_api_url, params={'q': product_url}, timeout=10)
-            response.raise_for_status()
-            results = response.json()['items']
-            if not results:
-                log.error('No repo matching "%s" found.', product_url)
-                sys.exit(1)
-            product_url = results[0]['ssh_url']
+    if PRODUCT_NAME_RE.match(product_url):
+        product_url = resolve_product_url(product_url)
+        if not quiet:
             click.echo('Using repo url ' + product_url)
-
-        except Exception as e:
-            log.error('Could not find repo for %s using %s due to error: ', product_url,
-                      config.checkout.search_api_url, e)
-            sys.exit(1)
-
-    elif USER_REPO_REFERENCE_RE.match(product_url):
-        product_url = config.checkout.user_repo_url % product_url
+    else:
+        product_url = resolve_product_url(product_url)
 
     is_origin = not config.checkout.origin_user or config.checkout.origin_user + '/' in product_url
     remote_name = DEFAULT_REMOTE if is_origin else UPSTREAM_REMOTE
 
-    silent_run(['git', 'clone', product_url, checkout_path, '--origin', remote_name])
+    clone_opts = [opt.format(depth=config.checkout.clone_depth) for opt in CLONE_STRATEGIES[clone_strategy]]
+
+    if config.checkout.mirror_cache and clone_strategy == 'full':
+        mirror = update_mirror(product_url)
+        if mirror:
+            clone_opts.extend(['--reference-if-able', mirror, '--dissociate'])
+
+    silent_run(['git', 'clone'] + clone_opts + [product_url, checkout_path, '--origin', remote_name])
+    invalidate_parent_paths()
 
     if not is_origin:
         origin_url = re.sub(r'(\.com[:/])(\w+)(/)', r'\1{}\3'.format(config.checkout.origin_user), product_url)
         silent_run(['git', 'remote', 'add', DEFAULT_REMOTE, origin_url], cwd=checkout_path)
 
 
+def mirror_path(product_url):
+    """ Path to the bare mirror of the product url in the mirror cache. See [checkout] mirror_cache config. """
+    if '://' in product_url:
+        url = urlparse(product_url)
+        host, path = url.hostname or 'localhost', url.path
+    elif ':' in product_url:
+        host, path = product_url.split(':', 1)
+        host = host.split('@')[-1]
+    else:
+        host, path = 'localhost', os.path.abspath(product_url)
+
+    path = path.strip('/')
+    if not path.endswith('.git'):
+        path += '.git'
+
+    return os.path.join(os.path.expanduser(CACHE_DIR), 'mirrors', host, path)
+
+
+def update_mirror(product_url):
+    """
+    Create or incrementally update the bare mirror of the product url in the mirror cache.
+
+    :return: Path to the mirror, or None if it could not be updated (such as when offline)
+    """
+    mirror = mirror_path(product_url)
+
+    if os.path.exists(mirror):
+        output, success = silent_run(['git', 'remote', 'update', '--prune'], cwd=mirror, return_output=2)
+
+    else:
+        if not os.path.exists(os.path.dirname(mirror)):
+            os.makedirs(os.path.dirname(mirror))
+
+        # Clone to a temp path first so an interrupted clone does not leave a partial mirror behind
+        temp_mirror = '{}.{}.tmp'.format(mirror, os.getpid())
+        output, success = silent_run(['git', 'clone', '--mirror', product_url, temp_mirror], return_output=2)
+        if success:
+            os.rename(temp_mirror, mirror)
+        else:
+            shutil.rmtree(temp_mirror, ignore_errors=True)
+
+    if success:
+        return mirror
+
+    log.debug('Could not update mirror for %s: %s', product_url, output)
+
+
+@changes_repo_state
 def checkout_files(files, repo_path=None):
     """ Checks out the given list of files. Raises on error. """
     silent_run(['git', 'checkout'] + files, cwd=repo_path)
 
 
+@changes_repo_state
 def hard_reset(to_commit):
     run(['git', 'reset', '--hard', to_commit])
 
@@ -498,7 +1303,13 @@ def product_checkout_path(product_url, workspace_dir=None):
 
 
 def product_path(name, workspace_dir=None):
+    """ Path to the product checkout in workspace, which may not exist yet. """
     if not workspace_dir:
         workspace_dir = workspace_path()
 
-    return os.path.join(workspace_dir, name)
+    path = os.path.join(workspace_dir, name)
+    if os.path.exists(path):
+        return path
+
+    # Checkout may be in a dir with a different name, e.g. foo_trunk
+    return workspace_index().products(workspace_dir).get(name) or path
@@ -1,14 +1,25 @@
+from collections import OrderedDict
 from contextlib import contextmanager
 import logging
 import os
 import signal
 import sys
 import tempfile
+import threading
 from utils.process import run
 
+from workspace.config import config
+
 
 log = logging.getLogger(__name__)
 
+#: Max number of (path, marker) lookups to cache for :func:`parent_path_with_dir` / :func:`parent_path_with_file`
+PARENT_PATH_CACHE_SIZE = 1024
+
+_parent_paths = OrderedDict()
+_parent_paths_cwd = None
+_parent_paths_lock = threading.Lock()
+
 
 def shortest_id(name, names):
     """ Return shortest name that isn't a duplicate in names """
@@ -38,26 +49,26 @@ def prompt_with_editor(instruction):
 
 def parent_path_with_dir(directory, path=None):
     """
-    Find parent that contains the given directory.
+    Find parent that contains the given directory. Results are cached, see :func:`invalidate_parent_paths`
 
     :param str directory: Directory to look for
     :param str path: Initial path to look from. Defaults to current working directory.
     :return: Parent path that contains the directory
     :rtype: str on success or False on failure
     """
-    return parent_path_with(lambda p: os.path.isdir(os.path.join(p, directory)), path=path)
+    return _cached_parent_path_with(('dir', directory), lambda p: os.path.isdir(os.path.join(p, directory)), path=path)
 
 
 def parent_path_with_file(name, path=None):
     """
-    Find parent that contains the given directory.
+    Find parent that contains the given file. Results are cached, see :func:`invalidate_parent_paths`
 
     :param str name: File name to look for
     :param str path: Initial path to look from. Defaults to current working directory.
     :return: Parent path that contains the file name
     :rtype: str on success or False on failure
     """
-    return parent_path_with(lambda p: os.path.isfile(os.path.join(p, name)), path=path)
+    return _cached_parent_path_with(('file', name), lambda p: os.path.isfile(os.path.join(p, name)), path=path)
 
 
 def parent_path_with(check, path=None):
@@ -69,16 +80,66 @@ def parent_path_with(check, path=None):
     :return: Parent path that contains the directory
     :rtype: str on success or False on failure
     """
-    if path == '/':
-        return False
+    path = os.path.abspath(path) if path else os.getcwd()
+
+    while path != '/':
+        if check(path):
+            return path
+        path = os.path.dirname(path)
+
+    return False
+
+
+def _cached_parent_path_with(marker, check, path=None):
+    """
+    Same as :func:`parent_path_with`, but looks up / caches the result for each path walked using (path, marker)
+    in a LRU cache, so later lookups from the same path or any path in between are answered without any stat.
+    """
+    global _parent_paths_cwd
+
+    cwd = os.getcwd()
+    path = os.path.abspath(path) if path else cwd
+
+    with _parent_paths_lock:
+        if cwd != _parent_paths_cwd:
+            _parent_paths.clear()
+            _parent_paths_cwd = cwd
+
+        if (path, marker) in _parent_paths:
+            _parent_paths.move_to_end((path, marker))
+            return _parent_paths[(path, marker)]
+
+    walked = []
+    result = False
+
+    while path != '/':
+        with _parent_paths_lock:
+            cached = _parent_paths.get((path, marker))
+        if cached is not None:
+            result = cached
+            break
+
+        walked.append(path)
+
+        if check(path):
+            result = path
+            break
 
-    if not path:
-        path = os.getcwd()
+        path = os.path.dirname(path)
 
-    if check(path):
-        return path
+    with _parent_paths_lock:
+        for path in walked:
+            _parent_paths[(path, marker)] = result
+        while len(_parent_paths) > PARENT_PATH_CACHE_SIZE:
+            _parent_paths.popitem(last=False)
 
-    return parent_path_with(check, os.path.dirname(path))
+    return result
+
+
+def invalidate_parent_paths():
+    """ Clear cached results for :func:`parent_path_with_dir` / :func:`parent_path_with_file` """
+    with _parent_paths_lock:
+        _parent_paths.clear()
 
 
 @contextmanager
@@ -106,60 +167,161 @@ def log_exception(title=None, exit=False, call=None, stack=False):
             sys.exit(1)
 
 
-def parallel_call(call, args, callback=None, workers=10, show_progress=None, progress_title='Progress'):
+def parallel_executor(executor='auto'):
+    """
+    Resolve the executor backend to use for parallel calls.
+
+    :param str executor: thread, process, or auto to use [parallel] executor in workspace.cfg,
+                         which defaults to thread when it is also auto.
+    :return: thread or process
+    """
+    if executor == 'auto':
+        executor = config.parallel.executor or 'auto'
+
+    if executor == 'auto':
+        executor = 'thread'
+
+    if executor not in ('thread', 'process'):
+        raise ValueError('Invalid executor "%s" - it should be thread, process, or auto' % executor)
+
+    return executor
+
+
+def default_workers(count, executor='auto'):
+    """
+    Number of workers to use for the given number of calls.
+
+    :param int count: Number of calls that will be made
+    :param str executor: Executor backend. See :func:`parallel_executor`
+    :return: [parallel] workers in workspace.cfg if set, or 4 per CPU for threads / 1 per CPU for processes,
+             but no more than count.
+    """
+    workers = config.parallel.workers
+
+    if not workers:
+        workers = (os.cpu_count() or 1) * (4 if parallel_executor(executor) == 'thread' else 1)
+
+    return max(1, min(workers, count))
+
+
+def parallel_call(call, args, callback=None, workers=None, show_progress=None, progress_title='Progress',
+                  executor='auto'):
     """
     Call a callable in parallel for each arg
 
+    Results, callback, and progress are handled as soon as each call completes.
+
     :param callable call: Callable to call
     :param list(iterable|non-iterable) args: List of args to call. One call per args.
-    :param callable callback: Callable to call for each result.
-    :param int workers: Number of workers to use.
+    :param callable callback: Callable to call for each successful result.
+    :param int workers: Number of workers to use. Defaults to :func:`default_workers`
     :param bool/str/callable: Show progress.
                               If callable, it should accept two lists: completed args and all args and return progress string.
+    :param str executor: Executor backend to use: thread (for calls that mostly wait on subprocesses), process
+                         (call and args must be picklable), or auto. See :func:`parallel_executor`
     :return dict: Map of args to their results on completion
     """
-    from multiprocessing import Pool, TimeoutError
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+    executor = parallel_executor(executor)
+    workers = workers or default_workers(len(args), executor)
 
     signal.signal(signal.SIGTERM, lambda *args: sys.exit(1))
-    pool = Pool(workers, lambda: signal.signal(signal.SIGINT, signal.SIG_IGN))
+    if executor == 'thread':
+        pool = ThreadPoolExecutor(workers)
+    else:
+        pool = ProcessPoolExecutor(workers, initializer=_init_worker)
+    futures = {}
 
     def to_tuple(a):
         return a if isinstance(a, (list, tuple, set)) else [a]
 
     try:
-        async_results = [(arg, pool.apply_async(call, to_tuple(arg), callback=callback)) for arg in args]
+        futures = dict((pool.submit(call, *to_tuple(arg)), arg) for arg in args)
 
         results = {}
-        while len(results) != len(async_results):
-            for arg, result in async_results:
-                if arg not in results:
-                    try:
-                        # This allows processes to be interrupted by CTRL+C
-                        results[arg] = result.get(1)
-                    except TimeoutError:
-                        pass
-                    except Exception as e:
-                        results[arg] = str(e)
+        completed = []
+
+        # Waiting on completion (instead of polling each result) allows processes to be interrupted by CTRL+C
+        for future in as_completed(futures):
+            arg = futures[future]
+
+            try:
+                results[arg] = future.result()
+            except Exception as e:
+                results[arg] = str(e)
+            else:
+                if callback:
+                    callback(results[arg])
+
+            completed.append(arg)
 
             if show_progress:
                 if callable(show_progress):
-                    progress = show_progress(list(results.keys()), args)
+                    progress = show_progress(completed, args)
                 else:
-                    progress = '%.2f%% completed' % (len(results) * 100.0 / len(async_results))
+                    progress = '%.2f%% completed' % (len(completed) * 100.0 / len(futures))
                 show_status('%s: %s' % (progress_title, progress))
 
-        pool.close()
-        pool.join()
+        pool.shutdown()
 
         return results
 
     except KeyboardInterrupt:
-        os.killpg(os.getpid(), signal.SIGTERM)  # Kills any child processes from subprocesses.
-        pool.terminate()
-        pool.join()
+        # Stop queued calls from starting and workers from running, like multiprocessing's Pool.terminate()
+        for future in futures:
+            future.cancel()
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False)
+
+        try:
+            os.killpg(os.getpid(), signal.SIGTERM)  # Kills any child processes from subprocesses.
+        except OSError:
+            pass  # Not a process group leader
+
         sys.exit()
 
 
+def _init_worker():
+    """
+    Ignore CTRL+C in worker processes so only the parent handles it, and let SIGTERM from the parent end them.
+    The exiting SIGTERM handler of the parent would only fail the current call as the worker catches SystemExit.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def parallel_map(call, args, workers=None):
+    """
+    Call a callable in parallel threads for each arg and yield the results in the same order as args.
+
+    A result is yielded as soon as it is ready and all results before it have been yielded, so callers can start
+    showing the first results while the rest are still running. Use for subprocess bound calls only, as threads
+    share the GIL.
+
+    :param callable call: Callable to call with each arg
+    :param list args: List of args. One call per arg.
+    :param int workers: Max number of threads to use. Defaults to :func:`default_workers`
+    :return: Generator of results in the same order as args
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    args = list(args)
+    workers = workers or default_workers(len(args), 'thread')
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(args))))
+    futures = [executor.submit(call, arg) for arg in args]
+
+    try:
+        for future in futures:
+            yield future.result()
+
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
 def show_status(message):
     """
       :param str message: Status message to show. If not, then status bar will be cleared.
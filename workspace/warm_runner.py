@@ -0,0 +1,322 @@
+"""
+Warm pytest runner for test envs.
+
+The server part of this module is run by the python of a test env (which does not have workspace-tools installed),
+so it should only use the standard library. It imports pytest and the dependencies of the product once, and then
+forks a worker for each test run requested over a unix socket, so a run only pays for collecting and running the
+selected tests. The server exits when any of the watched files (e.g. requirements.txt or tox.ini) changes, so the
+next run starts a new one with the updated dependencies, or when it has been idle for a while.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+#: Marks the end of the test output that is followed by the exit code (or "restart") of the run
+END_MARKER = b'\n--wst-warm-runner-end-- '
+
+#: Seconds to wait for a server to start listening
+START_TIMEOUT = 60
+
+#: Seconds of idle time before the server exits
+IDLE_TIMEOUT = 3600
+
+
+class WarmRunnerError(Exception):
+    """ Server could not be started or did not respond """
+
+
+def socket_path(python):
+    """
+    Path to the server socket for the given env python.
+
+    Socket paths are limited to about 100 chars, so it is in a dir in the temp dir instead of the env dir. The dir is
+    only accessible by the user, so other users can not connect to or replace the socket.
+
+    :raises WarmRunnerError: if the dir is not owned by the user or is accessible by others
+    """
+    socket_dir = os.path.join(tempfile.gettempdir(), 'wst-warm-{}'.format(os.getuid()))
+
+    try:
+        os.mkdir(socket_dir, 0o700)
+    except OSError:
+        if not os.path.isdir(socket_dir):
+            raise
+
+    dir_stat = os.lstat(socket_dir)
+    if not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_uid != os.getuid() or dir_stat.st_mode & 0o077:
+        raise WarmRunnerError('{} is not a dir that is only accessible by the user'.format(socket_dir))
+
+    key = hashlib.sha1(os.path.abspath(python).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(socket_dir, '{}.sock'.format(key))
+
+
+def file_signatures(paths):
+    """ List of [mtime, size] for the paths, or None for paths that do not exist """
+    signatures = []
+
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signatures.append([stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            signatures.append(None)
+
+    return signatures
+
+
+class WarmRunner(object):
+    """ Client to run pytest with the warm server of a test env. The server is started when needed. """
+
+    def __init__(self, python, watch_files=(), preload=(), idle_timeout=IDLE_TIMEOUT, log_file=None):
+        """
+        :param str python: Path to python of the test env
+        :param list watch_files: Files that the server restarts for when any of them changes
+        :param list preload: Modules to import in the server. Modules that are not installed in the env (such as
+                             ones installed in editable mode) are skipped as they may change between runs.
+        :param int idle_timeout: Seconds of idle time before the server exits
+        :param str log_file: File to write server output to. Defaults to .wst-warm-runner.log in the env dir.
+        """
+        self.python = python
+        self.watch_files = list(watch_files)
+        self.preload = list(preload)
+        self.idle_timeout = idle_timeout
+        self.log_file = log_file or os.path.join(os.path.dirname(os.path.dirname(python)), '.wst-warm-runner.log')
+        self.socket_path = socket_path(python)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def start(self):
+        """ Start the server and wait for it to listen """
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        envdir = os.path.dirname(os.path.dirname(self.python))
+        env = dict(os.environ, VIRTUAL_ENV=envdir, PATH=os.pathsep.join([os.path.dirname(self.python), os.environ.get('PATH', '')]))
+        env.pop('PYTHONHOME', None)
+        env.pop('PYTHONPATH', None)  # Set per run by the worker, see run_worker
+
+        cmd = [self.python, os.path.abspath(__file__), '--socket', self.socket_path,
+               '--idle-timeout', str(self.idle_timeout)]
+        for path in self.watch_files:
+            cmd.extend(['--watch', path])
+        for module in self.preload:
+            cmd.extend(['--preload', module])
+
+        with open(self.log_file, 'w') as log_fp:
+            server = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log_fp, stderr=subprocess.STDOUT, env=env,
+                                      start_new_session=True)
+
+        deadline = time.time() + START_TIMEOUT
+        while time.time() < deadline:
+            if server.poll() is not None:
+                raise WarmRunnerError('Warm runner exited with {} (see {})'.format(server.returncode, self.log_file))
+            try:
+                self._connect().close()
+                return
+            except Exception:
+                time.sleep(0.05)
+
+        server.kill()
+        raise WarmRunnerError('Warm runner did not start in {} seconds (see {})'.format(START_TIMEOUT, self.log_file))
+
+    def stop(self):
+        """ Stop the server if it is running """
+        try:
+            self._request({'stop': True})
+        except Exception:
+            pass
+
+    def _request(self, request, output=None):
+        sock = self._connect()
+
+        try:
+            sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+            # Output is written as it arrives, except for the last bit that may be part of the end marker
+            hold = len(END_MARKER) + 16
+            buffer = b''
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                if output and len(buffer) > hold:
+                    output(buffer[:-hold])
+                    buffer = buffer[-hold:]
+
+        finally:
+            sock.close()
+
+        text, marker, status = buffer.rpartition(END_MARKER)
+        if not marker:
+            raise WarmRunnerError('Warm runner did not complete the run')
+
+        if output and text:
+            output(text)
+
+        return status.decode('utf-8').strip()
+
+    def run(self, args, cwd, env=None, output=None):
+        """
+        Run pytest with the args in a worker forked from the server
+
+        :param list args: Args to pass to pytest
+        :param str cwd: Dir to run pytest in
+        :param dict env: Environment of the run. Defaults to the current environment.
+        :param callable output: Called with each chunk of test output (bytes)
+        :return: Exit code of pytest
+        """
+        request = {'args': list(args), 'cwd': cwd, 'env': dict(os.environ) if env is None else env}
+
+        for _ in range(2):
+            try:
+                status = self._request(request, output)
+            except (IOError, OSError):  # Not running
+                self.start()
+                status = self._request(request, output)
+
+            if status != 'restart':
+                return int(status)
+
+            self.start()
+
+        raise WarmRunnerError('Warm runner keeps restarting (see {})'.format(self.log_file))
+
+
+def preload_modules(modules):
+    """ Import the modules that are installed in the env (under sys.prefix) """
+    prefix = os.path.realpath(sys.prefix)
+
+    for module in modules:
+        try:
+            spec = importlib.util.find_spec(module)
+            if spec and spec.origin and os.path.realpath(spec.origin).startswith(prefix + os.sep):
+                importlib.import_module(module)
+        except Exception as e:
+            print('Could not preload {}: {}'.format(module, e))
+
+
+def run_worker(conn, request):
+    """ Run pytest for the request with output sent to the connection. It is called in a forked worker. """
+    try:
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(conn.fileno(), 1)
+        os.dup2(conn.fileno(), 2)
+        sys.stdout = os.fdopen(1, 'w', 1)
+        sys.stderr = os.fdopen(2, 'w', 1)
+
+        env = request.get('env') or {}
+        os.environ.clear()
+        os.environ.update(env)
+        os.chdir(request['cwd'])
+        # Same sys.path as the pytest console script of the env: its bin dir, PYTHONPATH entries, and then the rest
+        # of the default path (server is started without PYTHONPATH, and its script dir is sys.path[0])
+        sys.path[:] = ([os.path.dirname(sys.executable)]
+                       + [os.path.abspath(p) for p in env.get('PYTHONPATH', '').split(os.pathsep) if p]
+                       + sys.path[1:])
+        sys.argv = ['pytest'] + request['args']
+
+        import pytest
+        code = pytest.main(request['args'])
+
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(int(code))
+
+
+def serve(socket_path, watch_files=(), preload=(), idle_timeout=IDLE_TIMEOUT):
+    """ Serve test runs on the unix socket until a watched file changes or idle timeout """
+    import pytest  # noqa - Fail early if pytest is not installed
+    preload_modules(preload)
+
+    signatures = file_signatures(watch_files)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(5)
+    server.settimeout(idle_timeout)
+
+    def close():
+        # Socket is removed before replying, so it does not remove the socket of the next server started by the client
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                print('Idle for {} seconds, exiting'.format(idle_timeout))
+                return
+
+            conn.settimeout(None)
+
+            with conn:
+                line = conn.makefile('rb').readline()
+                if not line.strip():  # Connection check from the client
+                    continue
+                request = json.loads(line.decode('utf-8'))
+
+                if request.get('stop'):
+                    close()
+                    conn.sendall(END_MARKER + b'stopped')
+                    return
+
+                if file_signatures(watch_files) != signatures:
+                    print('Watched files changed, exiting')
+                    close()
+                    conn.sendall(END_MARKER + b'restart')
+                    return
+
+                pid = os.fork()
+                if pid == 0:
+                    server.close()
+                    run_worker(conn, request)
+
+                _, status = os.waitpid(pid, 0)
+                code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+                conn.sendall(END_MARKER + str(code).encode('utf-8'))
+
+    finally:
+        if server.fileno() != -1:
+            close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm pytest runner for a test env')
+    parser.add_argument('--socket', required=True, help='Path to unix socket to listen on')
+    parser.add_argument('--watch', action='append', default=[], help='Exit when the file changes')
+    parser.add_argument('--preload', action='append', default=[], help='Module to import upfront')
+    parser.add_argument('--idle-timeout', type=int, default=IDLE_TIMEOUT, help='Seconds of idle time before exit')
+    args = parser.parse_args()
+
+    serve(args.socket, args.watch, args.preload, args.idle_timeout)
+
+
+if __name__ == '__main__':
+    main()